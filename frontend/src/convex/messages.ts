@@ -1,4 +1,4 @@
-import { query } from "./_generated/server";
+import { internalMutation, query } from "./_generated/server";
 import { v } from "convex/values";
 import authCheck from './session';
 
@@ -120,5 +120,25 @@ export const getAnalytics = query({
     return await ctx.db.query("analytics").first();
   }});
 
+// Used by import-imessage.py to drop removed/changed messages before it
+// appends the delta. Internal, so only `npx convex run` can call it.
+export const deleteByIds = internalMutation({
+  args: {
+    ids: v.array(v.string()),
+  },
+  handler: async (ctx, args) => {
+    let deleted = 0;
+    for (const id of args.ids) {
+      const messages = await ctx.db.query("messages")
+            .withIndex("by_sj_id", (q) => q.eq("id", id))
+            .collect();
+      for (const message of messages) {
+        await ctx.db.delete(message._id);
+        deleted++;
+      }
+    }
+    return deleted;
+  }});
+
 const sortMessages = (messages: any[]) =>
   messages.sort((a, b) => a.timestamp.localeCompare(b.timestamp));
@@ -1,19 +1,34 @@
 import sys
 import collections
+import contextlib
+import io
+import itertools
 from collections import defaultdict
+from operator import attrgetter
 import re
-from datetime import datetime, timedelta
+from datetime import datetime
 import emoji
 import json
 from pathlib import Path
-from message import load_messages_from_merged
+import instrument
+import message_db
+import rollups
+from archive import open_archive
+from extsort import sort_by
+from message import MERGED_PATH, iter_lines, store_from_lines
+from mmap_reader import MergedFile
+from metrics import (
+    METRICS,
+    find_bursting_words,
+    load_checkpoint,
+    run_metrics,
+    run_metrics_sharded,
+    save_checkpoint,
+)
+import tokens
+from tokens import ascii_pattern, skip_word_list
 import matplotlib.pyplot as plt
-
-skip_word_list = [
-    "[",
-    "]",
-    "http",
-]
+import vectorized
 
 
 def total_word_count(messages):
@@ -114,16 +129,14 @@ def message_count_by_hour(messages):
 
 
 def average_response_time_per_day(messages):
-    # Group messages by day.
-    msg_by_day = collections.defaultdict(list)
-    for msg in messages:
-        msg_by_day[msg.timestamp.date()].append(msg)
+    # Sort everything by time once (spilling to disk if it's big), then each
+    # day is a consecutive group. Same order as sorting every day on its own.
+    messages_sorted = sort_by(messages, key=attrgetter("timestamp"))
 
     breakdown = {}   # holds per-sender averages for each day
     total_avg = {}   # holds the combined average response time for each day
 
-    for day, day_msgs in msg_by_day.items():
-        day_msgs.sort(key=lambda m: m.timestamp)
+    for day, day_msgs in itertools.groupby(messages_sorted, key=lambda m: m.timestamp.date()):
         stephen_total = 0
         stephen_count = 0
         nadia_total = 0
@@ -155,7 +168,7 @@ def average_response_time_per_day(messages):
 
 
 def overall_average_response_time(messages):
-    messages_sorted = sorted(messages, key=lambda m: m.timestamp)
+    messages_sorted = sort_by(messages, key=attrgetter("timestamp"))
     stephen_total = 0
     stephen_count = 0
     nadia_total = 0
@@ -207,14 +220,7 @@ def detect_new_word_bursts(messages, save_to_png=False):
        (e.g., "mrr" or "mrr*"), and values are dicts mapping month (datetime) to count.
     """
 
-    # helper: collapse repeated letters.
-    def normalize_word(word):
-        # For example, 'mrrr' becomes 'mr' – note this simple method will collapse all runs.
-        return re.sub(r'(.)\1+', r'\1', word)
-
-    ascii_pattern = re.compile(r"\b[a-zA-Z]+\b")
     global_start = min(msg.timestamp for msg in messages)
-    boundary_date = global_start + timedelta(days=60)
 
     # First pass: build counts per word per month (for each original word)
     word_month_counts = defaultdict(lambda: defaultdict(int))
@@ -226,53 +232,7 @@ def detect_new_word_bursts(messages, save_to_png=False):
         for word in words:
             word_month_counts[word][month_key] += 1
 
-    # Detect bursting words in the original dictionary.
-    bursting_words = {}
-    for word, month_counts in word_month_counts.items():
-        total_usage = sum(month_counts.values())
-        if total_usage <= 25:
-            continue
-        months_sorted = sorted(month_counts.keys())
-        if not months_sorted:
-            continue
-        # Consider only words that did NOT appear until after the first two months.
-        first_month = months_sorted[0]
-        if first_month < boundary_date:
-            continue
-        base_count = month_counts[first_month]
-        burst_found = False
-        for m in months_sorted[1:]:
-            if month_counts[m] >= 5 * base_count:
-                burst_found = True
-                break
-        if burst_found:
-            bursting_words[word] = month_counts
-
-    # Now, group similar bursting words using normalization.
-    # For each original bursting word, compute its normalized form.
-    # Then merge counts for words with the same normalized outcome.
-    grouped_bursts = {}  # key: normalized word, value: tuple(set(original_words), merged_counts dict)
-    for word, month_counts in bursting_words.items():
-        norm = normalize_word(word)
-        if norm not in grouped_bursts:
-            # Create a copy of month_counts so later merging will work fine.
-            grouped_bursts[norm] = (set([word]), dict(month_counts))
-        else:
-            orig_set, merged = grouped_bursts[norm]
-            orig_set.add(word)
-            for m, count in month_counts.items():
-                merged[m] = merged.get(m, 0) + count
-
-    # Create the final dictionary to return and plot.
-    # For each group, if more than one word was merged or the original word doesn't equal the normalized version,
-    # add an asterisk to indicate merging.
-    final_bursts = {}
-    for norm, (orig_set, merged_counts) in grouped_bursts.items():
-        if len(orig_set) > 1 or any(word != norm for word in orig_set):
-            label = norm + "*"
-        else:
-            label = norm
-        final_bursts[label] = merged_counts
+    final_bursts = find_bursting_words(word_month_counts, global_start)
 
     # Plot timeline for each grouped bursting word.
     for label, month_counts in final_bursts.items():
@@ -309,40 +269,21 @@ def detect_new_word_bursts(messages, save_to_png=False):
 
 
 
-argument = sys.argv[1]
-messages = load_messages_from_merged()
-
-if argument == "totals":
-    total_word_count(messages)
-    message_counts(messages)
-    num_days(messages)
-    messages_per_day(messages)
-elif argument == "emoji":
-    emoji_frequency(messages)
-elif argument == "words":
-    calculate_word_frequencies(messages, top_n=20)
-elif argument == "person-day":
-    message_frequency_per_day_per_person(messages)
-elif argument == "hour":
-    message_count_by_hour(messages)
-elif argument == "burst":
-    detect_new_word_bursts(messages)
-elif argument == "all":
-    # Run all analytics functions.
-    tw = total_word_count(messages)
-    msg_counts = message_counts(messages)
-    nd = num_days(messages)
-    mpd = messages_per_day(messages)
-    ef = emoji_frequency(messages)
-    wf = calculate_word_frequencies(messages)
-    mfpdp = message_frequency_per_day_per_person(messages)
-    mcbh = message_count_by_hour(messages)
-    
-    art_breakdown, art_total = average_response_time_per_day(messages)
-    overall_rt = overall_average_response_time(messages)
-    
-    # Detect bursting words (plots are saved as PNG) and capture the series.
-    bursting_words = detect_new_word_bursts(messages, save_to_png=False)
+CHECKPOINT_PATH = Path("../output/analytics_state.json")
+
+
+def write_analytics_json(results):
+    tw = results["num_words_total"]
+    msg_counts = results["num_messages"]
+    nd = results["num_days"]
+    mpd = msg_counts[0] / nd if nd else 0
+    ef = results["emoji_frequency"]
+    wf = results["word_frequency"]
+    mfpdp = results["message_frequency_per_day_per_person"]
+    mcbh = results["message_count_by_hour"]
+    art_breakdown, art_total, overall_rt, rt_percentiles = results["response_times"]
+
+    bursting_words = results["bursting_word_series"]
     # Convert bursting words month_counts to JSON serializable form.
     bursting_word_series = {}
     for word, month_counts in bursting_words.items():
@@ -374,6 +315,7 @@ elif argument == "all":
             str(day): art_total[day] for day in sorted(art_total)
         },
         "average_response_time_overall": overall_rt,
+        "response_time_percentiles_overall": rt_percentiles,
         "bursting_word_series": bursting_word_series,  # New data series added
     }
 
@@ -383,7 +325,167 @@ elif argument == "all":
         json.dump([json_results], f, ensure_ascii=False, indent=2)
 
     print(f"Analytics JSON written to {output_path}")
-else:
-    print(
-        "Please specify one of the valid arguments: totals, emoji, words, person-day, hour, all, burst"
-    )
+
+
+def load_messages(since=None):
+    # cheapest first: the binary archive merge.py writes (archive.py), the
+    # SQLite store (message_db.py), then merged.jsonl itself
+    archive = open_archive()
+    if archive is not None:
+        try:
+            return archive.store(since)
+        finally:
+            archive.close()
+    if message_db.fresh():
+        db = message_db.MessageDB()
+        try:
+            return db.store(since=since)
+        finally:
+            db.close()
+    if since is not None:
+        # the time index lets the mapped file skip straight to `since`
+        merged = MergedFile()
+        try:
+            return merged.store(since=since)
+        finally:
+            merged.close()
+    return store_from_lines(iter_lines(MERGED_PATH))
+
+
+def run_all(flags):
+    with instrument.run("analytics"):
+        _run_all(flags)
+
+
+def _run_all(flags):
+    # With --incremental, restore the metric state saved by the previous run
+    # and only fold in messages newer than its high-water mark.
+    metrics = [cls() for cls in METRICS.values()]
+    since = None
+    if "--incremental" in flags:
+        since = load_checkpoint(CHECKPOINT_PATH, metrics)
+        if since is None:
+            print("No checkpoint found, running a full pass")
+        else:
+            print(f"Resuming from checkpoint at {since}")
+
+    # --workers N shards merged.jsonl by byte range across N processes.
+    workers = 1
+    if "--workers" in flags:
+        workers = int(flags[flags.index("--workers") + 1])
+
+    # --token-cache keeps the emoji scan of every non-ASCII message in
+    # ../output/token_cache.sqlite for the next run, see tokens.py.
+    # Workers don't share it.
+    if "--token-cache" in flags and workers == 1:
+        tokens.enable_disk_cache()
+
+    # All metrics are fed in a single pass, see metrics.py.
+    if workers > 1:
+        with instrument.stage("metrics"):
+            results = run_metrics_sharded(MERGED_PATH, workers, metrics, since=since)
+    else:
+        with instrument.stage("load") as stage:
+            messages = load_messages(since=since)
+            stage.records = len(messages)
+        with instrument.stage("metrics") as stage:
+            results = run_metrics(messages, metrics)
+            stage.records = len(messages)
+    tokens.close_disk_cache()
+
+    with instrument.stage("write"):
+        save_checkpoint(CHECKPOINT_PATH, metrics)
+        write_analytics_json(results)
+        # day/week/month/year buckets for date-range queries, see rollups.py
+        rollups.build(metrics)
+    print(f"Checkpoint written to {CHECKPOINT_PATH}")
+
+
+# metric name -> the reference function(s) that define it
+REFERENCE_FUNCTIONS = {
+    "num_messages": message_counts,
+    "num_words_total": total_word_count,
+    "num_days": num_days,
+    "word_frequency": calculate_word_frequencies,
+    "emoji_frequency": emoji_frequency,
+    "message_frequency_per_day_per_person": message_frequency_per_day_per_person,
+    "message_count_by_hour": message_count_by_hour,
+    "bursting_word_series": detect_new_word_bursts,
+    "response_times": lambda messages: (
+        *average_response_time_per_day(messages),
+        overall_average_response_time(messages),
+    ),
+}
+
+
+def reference_results(messages):
+    """{metric name: what the reference functions give}, without their printing."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return {name: function(messages) for name, function in REFERENCE_FUNCTIONS.items()}
+
+
+def same_result(name, result, expected):
+    if name == "response_times":
+        # the reference functions don't compute percentiles
+        result = result[:3]
+    # compare item order too, analytics.json depends on it
+    same = result == expected
+    if isinstance(expected, dict):
+        same = same and list(result.items()) == list(expected.items())
+    return same
+
+
+def check_parity(messages):
+    """
+    Compare the column/NumPy metrics against the reference functions above,
+    which stay as the readable definition of every number.
+    """
+    expected = reference_results(messages)
+    metrics = [METRICS[name]() for name in expected]
+    results = run_metrics(messages, metrics)
+
+    backend = "numpy" if vectorized.available() else "pure python"
+    ok = True
+    for name, value in expected.items():
+        same = same_result(name, results[name], value)
+        print(f"{name}: {'ok' if same else 'MISMATCH'}")
+        ok = ok and same
+    print(f"Parity ({backend}): {'ok' if ok else 'FAILED'}")
+    return ok
+
+
+def main():
+    argument = sys.argv[1]
+    flags = sys.argv[2:]
+
+    if argument == "all":
+        run_all(flags)
+        return
+
+    messages = load_messages()
+    if argument == "totals":
+        total_word_count(messages)
+        message_counts(messages)
+        num_days(messages)
+        messages_per_day(messages)
+    elif argument == "emoji":
+        emoji_frequency(messages)
+    elif argument == "words":
+        calculate_word_frequencies(messages, top_n=20)
+    elif argument == "person-day":
+        message_frequency_per_day_per_person(messages)
+    elif argument == "hour":
+        message_count_by_hour(messages)
+    elif argument == "burst":
+        detect_new_word_bursts(messages)
+    elif argument == "parity":
+        if not check_parity(messages):
+            sys.exit(1)
+    else:
+        print(
+            "Please specify one of the valid arguments: totals, emoji, words, person-day, hour, all [--incremental] [--workers N] [--token-cache], burst, parity"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import pytest
+
+import analytics
+import vectorized
+from benchmarks.generate import conversation
+from message import Message, MessageStore
+from metrics import METRICS, Metric, register, run_metrics
+
+
+def synthetic_messages(size=6000):
+    messages = []
+    for i, (ts, is_me, text, kind, _) in enumerate(conversation(size, seed=7)):
+        if kind == 'link':
+            # skipped by the word metrics
+            text += ' https://example.com'
+        elif kind == 'file':
+            text = '[sent file: IMG_0001.jpeg]'
+        messages.append(Message('Stephen' if is_me else 'Nadia', text, ts, f'm{i}'))
+
+    # a new word that bursts: a couple of uses in its first month, then a
+    # lot two months later (and a longer spelling grouped with it)
+    months = sorted({(msg.timestamp.year, msg.timestamp.month) for msg in messages})
+    first, later = months[2], months[4]
+    in_month = lambda month: [msg for msg in messages if (msg.timestamp.year, msg.timestamp.month) == month]
+    for j, msg in enumerate(in_month(first)[:4]):
+        msg.message += ' zoomies' if j % 2 else ' zooomies'
+    for j, msg in enumerate(in_month(later)[:60]):
+        msg.message += ' zoomies' if j % 2 else ' zooomies'
+    return messages
+
+
+MESSAGES = synthetic_messages()
+EXPECTED = analytics.reference_results(MESSAGES)
+
+
+def store_of(messages):
+    store = MessageStore()
+    for msg in messages:
+        store.append(msg.sender, msg.message, msg.timestamp)
+    return store
+
+
+@pytest.fixture(params=['numpy', 'pure python'])
+def backend(request, monkeypatch):
+    if request.param == 'numpy':
+        if not vectorized.available():
+            pytest.skip('NumPy is not installed')
+    else:
+        monkeypatch.setattr(vectorized, 'np', None)
+    return request.param
+
+
+@pytest.mark.parametrize('name', list(analytics.REFERENCE_FUNCTIONS))
+def test_store_metrics_match_reference(name, backend):
+    result = run_metrics(store_of(MESSAGES), [METRICS[name]()])[name]
+    assert analytics.same_result(name, result, EXPECTED[name])
+
+
+@pytest.mark.parametrize('name', list(analytics.REFERENCE_FUNCTIONS))
+def test_message_metrics_match_reference(name):
+    result = run_metrics(MESSAGES, [METRICS[name]()])[name]
+    assert analytics.same_result(name, result, EXPECTED[name])
+
+
+def test_the_data_covers_the_metrics():
+    # bursts need a few months, the word metrics some skipped messages
+    assert EXPECTED['bursting_word_series']
+    assert EXPECTED['emoji_frequency']
+    assert EXPECTED['num_words_total'] < sum(len(msg.message.split()) for msg in MESSAGES)
+
+
+def test_incomplete_metric_fails_at_registration():
+    class NoMerge(Metric):
+        def update(self, msg): pass
+        def finalize(self): pass
+        def state(self): pass
+        def load_state(self, state): pass
+
+    with pytest.raises(TypeError, match='merge'):
+        register('no_merge')(NoMerge)
+    assert 'no_merge' not in METRICS
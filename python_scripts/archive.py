@@ -0,0 +1,328 @@
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from bisect import bisect_left
+from datetime import timedelta
+
+import fingerprint
+from message import MERGED_PATH, MessageStore, from_epoch, iter_lines, records_from_lines, timestamp_to_epoch
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Compact binary copy of merged.jsonl, written by merge.py next to it.
+#
+#   header   magic, format version, compression, records per block,
+#            record count, record table offset, footer offset
+#   blocks   the ids and texts of each run of `records_per_block`
+#            records, concatenated and compressed (zstd if installed,
+#            otherwise zlib)
+#   records  one fixed-width row per message: int64 microseconds since a
+#            naive 1970-01-01, uint16 sender code, uint16 id length,
+#            uint32 text length, uint32 offset into its block
+#   footer   JSON metadata (sender names, fingerprint digest of the jsonl
+#            it was written with, see fingerprint.py), then the file offset of every block and the first
+#            timestamp in it
+#
+# Records are in merged.jsonl order, which is time order, so a time range
+# is a bisect over the record table, and only the blocks it touches get
+# decompressed. `to_jsonl` writes merged.jsonl back byte for byte, e.g. for
+# the Convex import.
+
+ARCHIVE_PATH = '../output/merged.nmdb'
+MAGIC = b'NMDBARC\x00'
+VERSION = 1
+HEADER = struct.Struct('<8sHHIQQQ')
+RECORD = struct.Struct('<qHHII')
+TIMESTAMP = struct.Struct('<q')
+RECORDS_PER_BLOCK = 4096
+
+NONE, ZLIB, ZSTD = 0, 1, 2
+COMPRESSION_NAMES = {NONE: 'none', ZLIB: 'zlib', ZSTD: 'zstd'}
+
+
+def timestamp_to_micros(ts: str) -> int:
+    # str(datetime): "%Y-%m-%d %H:%M:%S", plus ".%f" when there are microseconds
+    if len(ts) == 19:
+        return timestamp_to_epoch(ts) * 1_000_000
+    if len(ts) == 26 and ts[19] == '.':
+        return timestamp_to_epoch(ts) * 1_000_000 + int(ts[20:])
+    raise ValueError(f"can't archive timestamp {ts!r}")
+
+
+def micros_to_timestamp(micros: int) -> str:
+    seconds, micros = divmod(micros, 1_000_000)
+    return str(from_epoch(seconds) + timedelta(microseconds=micros))
+
+
+def default_compression():
+    return ZSTD if zstandard is not None else ZLIB
+
+
+def compress(data: bytes, compression: int) -> bytes:
+    if compression == ZSTD:
+        return zstandard.ZstdCompressor(level=6).compress(data)
+    if compression == ZLIB:
+        return zlib.compress(data, 6)
+    return data
+
+
+def decompress(data: bytes, compression: int) -> bytes:
+    if compression == ZSTD:
+        if zstandard is None:
+            raise RuntimeError('this archive is zstd-compressed; pip install zstandard to read it')
+        return zstandard.ZstdDecompressor().decompress(data)
+    if compression == ZLIB:
+        return zlib.decompress(data)
+    return data
+
+
+class ArchiveWriter:
+    def __init__(self, path=ARCHIVE_PATH, compression=None, records_per_block=RECORDS_PER_BLOCK):
+        self.path = path
+        self.compression = default_compression() if compression is None else compression
+        self.records_per_block = records_per_block
+        self.f = open(path + '.tmp', 'wb')
+        self.f.write(b'\x00' * HEADER.size)
+        self.senders = []
+        self.sender_index = {}
+        self.records = bytearray()
+        self.count = 0
+        self.block = bytearray()
+        self.block_offsets = array('Q')
+        self.block_starts = array('q')
+
+    def add(self, record):
+        micros = timestamp_to_micros(record['timestamp'])
+        sender = record['sender']
+        code = self.sender_index.get(sender)
+        if code is None:
+            code = self.sender_index[sender] = len(self.senders)
+            self.senders.append(sender)
+        message_id = record['id'].encode()
+        text = record['message'].encode()
+        if self.count % self.records_per_block == 0:
+            self.block_starts.append(micros)
+        self.records += RECORD.pack(micros, code, len(message_id), len(text), len(self.block))
+        self.block += message_id
+        self.block += text
+        self.count += 1
+        if self.count % self.records_per_block == 0:
+            self._flush_block()
+
+    def _flush_block(self):
+        self.block_offsets.append(self.f.tell())
+        self.f.write(compress(bytes(self.block), self.compression))
+        self.block = bytearray()
+
+    def close(self, jsonl_digest=None):
+        if self.count % self.records_per_block:
+            self._flush_block()
+        self.block_offsets.append(self.f.tell())
+        records_offset = self.f.tell()
+        self.f.write(self.records)
+
+        footer_offset = self.f.tell()
+        meta = json.dumps({'senders': self.senders, 'jsonl_digest': jsonl_digest}).encode()
+        self.f.write(struct.pack('<I', len(meta)))
+        self.f.write(meta)
+        self.f.write(struct.pack('<Q', len(self.block_starts)))
+        self.f.write(self.block_offsets.tobytes())
+        self.f.write(self.block_starts.tobytes())
+
+        self.f.seek(0)
+        self.f.write(HEADER.pack(
+            MAGIC, VERSION, self.compression, self.records_per_block, self.count, records_offset, footer_offset,
+        ))
+        self.f.close()
+        os.replace(self.path + '.tmp', self.path)
+
+    def abort(self):
+        """Drop the half-written archive; whatever was at `path` stays."""
+        self.f.close()
+        os.remove(self.path + '.tmp')
+
+
+class _Timestamps:
+    """Read-only sequence over the timestamp column, for bisect."""
+
+    def __init__(self, archive):
+        self.mm = archive.mm
+        self.offset = archive.records_offset
+        self.count = archive.count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        return TIMESTAMP.unpack_from(self.mm, self.offset + i * RECORD.size)[0]
+
+
+class Archive:
+    def __init__(self, path=ARCHIVE_PATH):
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (
+            magic, version, self.compression, self.records_per_block,
+            self.count, self.records_offset, footer_offset,
+        ) = HEADER.unpack_from(self.mm)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a message archive')
+        if version > VERSION:
+            raise ValueError(f'{path} is archive format v{version}, this reader only knows up to v{VERSION}')
+
+        meta_length, = struct.unpack_from('<I', self.mm, footer_offset)
+        pos = footer_offset + 4
+        meta = json.loads(self.mm[pos:pos + meta_length])
+        self.senders = meta['senders']
+        # None in archives not written from merged.jsonl, or by older versions
+        self.jsonl_digest = meta.get('jsonl_digest')
+        pos += meta_length
+        num_blocks, = struct.unpack_from('<Q', self.mm, pos)
+        pos += 8
+        self.block_offsets = array('Q', self.mm[pos:pos + 8 * (num_blocks + 1)])
+        pos += 8 * (num_blocks + 1)
+        self.block_starts = array('q', self.mm[pos:pos + 8 * num_blocks])
+        self.timestamps = _Timestamps(self)
+        self._block = (None, None)
+
+    def __len__(self):
+        return self.count
+
+    def matches(self, jsonl_path=MERGED_PATH) -> bool:
+        """Whether `jsonl_path` is the merged.jsonl this archive was written with."""
+        return fingerprint.matches(jsonl_path, self.jsonl_digest)
+
+    def row(self, i):
+        return RECORD.unpack_from(self.mm, self.records_offset + i * RECORD.size)
+
+    def block(self, k) -> bytes:
+        if self._block[0] != k:
+            start, end = self.block_offsets[k], self.block_offsets[k + 1]
+            self._block = (k, decompress(self.mm[start:end], self.compression))
+        return self._block[1]
+
+    def record(self, i) -> dict:
+        micros, code, id_length, text_length, offset = self.row(i)
+        block = self.block(i // self.records_per_block)
+        text_start = offset + id_length
+        # same key order as Message.to_dict, so to_jsonl reproduces the file
+        return {
+            'id': block[offset:text_start].decode(),
+            'message': block[text_start:text_start + text_length].decode(),
+            'sender': self.senders[code],
+            'timestamp': micros_to_timestamp(micros),
+        }
+
+    def __getitem__(self, i) -> dict:
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        return self.record(i)
+
+    def records(self, start=0, end=None):
+        end = self.count if end is None else end
+        return (self.record(i) for i in range(start, end))
+
+    def __iter__(self):
+        return self.records()
+
+    def find(self, micros: int) -> int:
+        """First record with a timestamp >= `micros`."""
+        # the footer's block start times narrow it down to one block first
+        k = bisect_left(self.block_starts, micros)
+        lo = max(k - 1, 0) * self.records_per_block
+        hi = min(k * self.records_per_block, self.count)
+        return bisect_left(self.timestamps, micros, lo, max(lo, hi))
+
+    def span(self, start: int, end: int):
+        """Record numbers [first, last) with start <= epoch seconds < end."""
+        return self.find(start * 1_000_000), self.find(end * 1_000_000)
+
+    def store(self, since=None) -> MessageStore:
+        """Load into a MessageStore, copying text straight from the blocks."""
+        first = 0
+        if since is not None:
+            # same order as comparing the timestamp strings, see records_from_lines
+            since = timestamp_to_micros(since)
+            first = self.find(since)
+        store = MessageStore()
+        # senders are interned as they appear, like MessageStore.append does
+        codes = [None] * len(self.senders)
+        latest = None
+        for i in range(first, self.count):
+            micros, code, id_length, text_length, offset = self.row(i)
+            if since is not None and micros <= since:
+                continue
+            if codes[code] is None:
+                codes[code] = len(store.senders)
+                store.sender_index[self.senders[code]] = codes[code]
+                store.senders.append(self.senders[code])
+            block = self.block(i // self.records_per_block)
+            start = offset + id_length
+            if latest is None or micros > latest:
+                latest = micros
+            store.timestamps.append(micros // 1_000_000)
+            store.sender_codes.append(codes[code])
+            store.text += block[start:start + text_length]
+            store.offsets.append(len(store.text))
+        if latest is not None:
+            store.latest = micros_to_timestamp(latest)
+        return store
+
+    def close(self):
+        self._block = (None, None)
+        self.mm.close()
+
+
+def open_archive(path=ARCHIVE_PATH, jsonl_path=MERGED_PATH):
+    """The archive for merged.jsonl, or None if it's missing or out of date."""
+    if not os.path.exists(path):
+        return None
+    archive = Archive(path)
+    if not archive.matches(jsonl_path):
+        archive.close()
+        return None
+    return archive
+
+
+def from_jsonl(jsonl_path=MERGED_PATH, path=ARCHIVE_PATH, compression=None) -> int:
+    writer = ArchiveWriter(path, compression)
+    for record in records_from_lines(iter_lines(jsonl_path)):
+        writer.add(record)
+    writer.close(fingerprint.digest(jsonl_path))
+    return writer.count
+
+
+def to_jsonl(path=ARCHIVE_PATH, jsonl_path=MERGED_PATH) -> int:
+    archive = Archive(path)
+    with open(jsonl_path, 'w') as f:
+        for record in archive:
+            f.write(json.dumps(record) + '\n')
+    count = len(archive)
+    archive.close()
+    return count
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command == 'from-jsonl':
+        jsonl_path = sys.argv[2] if len(sys.argv) > 2 else MERGED_PATH
+        print(f'Archived {from_jsonl(jsonl_path)} messages to {ARCHIVE_PATH}')
+    elif command == 'to-jsonl':
+        jsonl_path = sys.argv[2] if len(sys.argv) > 2 else MERGED_PATH
+        print(f'Wrote {to_jsonl(ARCHIVE_PATH, jsonl_path)} messages to {jsonl_path}')
+    elif command == 'info':
+        archive = Archive()
+        print(f'{len(archive)} messages, {len(archive.block_starts)} blocks, '
+              f'{COMPRESSION_NAMES[archive.compression]}, senders {archive.senders}')
+        archive.close()
+    else:
+        print('usage: archive.py [from-jsonl [JSONL] | to-jsonl [JSONL] | info]')
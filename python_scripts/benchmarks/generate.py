@@ -0,0 +1,198 @@
+import argparse
+import json
+import random
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# Deterministic synthetic chat histories in the three input formats the
+# pipeline reads: imessage-exporter txt, imessage-exporter JSON and the
+# Messenger JSON export. The same seed and size always give the same files.
+
+ME = "Me"
+THEM = "+15555550123"
+THEM_EMAIL = "nadia@example.com"
+SENDERS_CSV = f"{ME},Stephen\n{THEM},Nadia\n{THEM_EMAIL},Nadia"
+
+WORDS = (
+    "hey hi hello love you babe miss so much lol lmao ok okay yes no maybe "
+    "the a to and of in on at for with dinner lunch work home tonight "
+    "tomorrow today cat dog sleep tired hungry coffee movie game mrr mrrr "
+    "mrrrr cute nice wow omg haha hahaha good morning night see soon"
+).split()
+EMOJI = ["😀", "😂", "❤️", "🥺", "😭", "🐱", "✨", "👍", "🙏", "😴"]
+LINKS = ["https://example.com/article", "https://youtu.be/dQw4w9WgXcQ", "http://maps.example.org/place"]
+FILES = ["IMG_0001.jpeg", "IMG_4242.HEIC", "voice-memo.m4a", "notes.pdf"]
+
+APPLE_EPOCH = datetime(2001, 1, 1)
+UNIX_EPOCH = datetime(1970, 1, 1)
+
+
+def random_text(rng):
+    words = [rng.choice(WORDS) for _ in range(rng.randint(1, 14))]
+    if rng.random() < 0.15:
+        words.insert(rng.randrange(len(words) + 1), rng.choice(EMOJI))
+    if rng.random() < 0.05:
+        words.append(rng.choice(EMOJI) * rng.randint(2, 4))
+    text = " ".join(words)
+    if rng.random() < 0.05:
+        text += "\n" + " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 6)))
+    return text
+
+
+def conversation(size, seed=0, start=datetime(2019, 6, 1)):
+    """Yield (timestamp, is_me, text, kind, reacted) tuples in time order."""
+    rng = random.Random(seed)
+    ts = start
+    is_me = True
+    for _ in range(size):
+        # bursts of quick replies with the occasional long gap
+        gap = rng.expovariate(1 / 90) if rng.random() < 0.9 else rng.expovariate(1 / 20000)
+        ts += timedelta(seconds=int(gap) + 1)
+        if rng.random() < 0.6:
+            is_me = not is_me
+        roll = rng.random()
+        if roll < 0.03:
+            kind = "link"
+        elif roll < 0.05:
+            kind = "file"
+        elif roll < 0.07:
+            kind = "edited"
+        else:
+            kind = "text"
+        yield ts, is_me, random_text(rng), kind, rng.random() < 0.08
+
+
+def txt_timestamp(ts):
+    return f"{ts:%b %d, %Y} {ts.hour % 12 or 12}:{ts:%M:%S %p}"
+
+
+def write_txt(path, size, seed=0):
+    """imessage-exporter txt export (`imessage-exporter -f txt`)."""
+    with open(path, "w", encoding="utf-8") as f:
+        for ts, is_me, text, kind, reacted in conversation(size, seed):
+            suffix = "" if is_me else " (Read by you after 1 minute)"
+            f.write(f"{txt_timestamp(ts)}{suffix}\n")
+            f.write(f"{ME if is_me else THEM}\n")
+            if kind == "link":
+                url = LINKS[len(text) % len(LINKS)]
+                f.write(f"{url}\nExample Title\nexample.com\n")
+            elif kind == "file":
+                f.write(f"/Users/stephen/Library/Messages/Attachments/ab/12/{FILES[len(text) % len(FILES)]}\n")
+            elif kind == "edited":
+                f.write(f"Edited 1 time: {text}\n")
+            else:
+                f.write(text + "\n")
+            if reacted:
+                f.write("Reactions:\n")
+                f.write(f"    Loved by {THEM if is_me else ME} ({txt_timestamp(ts + timedelta(seconds=30))})\n")
+            if kind == "text" and len(text) % 23 == 0:
+                # threaded reply block, indented by the exporter
+                f.write("This message responded to an earlier message.\n")
+                f.write(f"    {txt_timestamp(ts - timedelta(minutes=5))}\n    {ME}\n    earlier message\n")
+            f.write("\n")
+
+
+def imessage_json_messages(size, seed):
+    rng = random.Random(seed + 1)
+    for i, (ts, is_me, text, kind, _) in enumerate(conversation(size, seed)):
+        apple_ns = int((ts - APPLE_EPOCH).total_seconds()) * 10**9
+        if kind == "file":
+            message_type, text = "attachment", "\ufffc"
+        elif kind == "link":
+            message_type, text = "message", LINKS[i % len(LINKS)]
+        else:
+            message_type = "message"
+        yield {
+            "id": f"{seed:04d}-{i:08d}",
+            "type": message_type,
+            "text": None if rng.random() < 0.01 else text,
+            "sender": ME if is_me else THEM,
+            "timestamp": apple_ns,
+        }
+
+
+def write_json_array(f, items):
+    # written item by item so 10M-message files don't have to fit in memory
+    f.write("[")
+    for i, item in enumerate(items):
+        if i:
+            f.write(", ")
+        f.write(json.dumps(item))
+    f.write("]")
+
+
+def write_imessage_json(path, size, seed=0):
+    """imessage-exporter JSON export: one block per conversation."""
+    # a group chat and another 1:1 around the real conversation, which the
+    # pipeline should skip
+    blocks = [
+        ([THEM, "+15555550999", ME], size // 20, seed + 1000),
+        ([THEM, ME], size, seed),
+        (["+15555550777", ME], size // 20, seed + 2000),
+    ]
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("[")
+        for i, (participants, count, block_seed) in enumerate(blocks):
+            if i:
+                f.write(", ")
+            f.write('{"participants": ' + json.dumps(participants) + ', "messages": ')
+            write_json_array(f, imessage_json_messages(count, block_seed))
+            f.write("}")
+        f.write("]")
+
+
+def messenger_messages(size, seed):
+    for i, (ts, is_me, text, kind, _) in enumerate(conversation(size, seed + 100, start=datetime(2017, 1, 1))):
+        if kind == "file":
+            message_type = "media"
+        elif kind == "link":
+            message_type, text = "link", LINKS[len(text) % len(LINKS)]
+        elif i % 997 == 500:
+            message_type = "placeholder"
+        else:
+            message_type = "text"
+        yield {
+            "type": message_type,
+            "text": text,
+            "senderName": "Stephen Jayakar" if is_me else "Nadia Example",
+            # naive on purpose so the output doesn't depend on the local zone
+            "timestamp": int((ts - UNIX_EPOCH).total_seconds()) * 1000,
+        }
+
+
+def write_messenger_json(path, size, seed=0):
+    """Messenger export as read by messenger.parse_messenger_json."""
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('{"participants": ["Stephen Jayakar", "Nadia Example"], "messages": ')
+        write_json_array(f, messenger_messages(size, seed))
+        f.write("}")
+
+
+def write_data_sources(directory, size, seed=0):
+    """Write a full ../data_sources directory for `size` messages per source."""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    # imessage_old.get_senders chokes on a trailing newline
+    (directory / "senders.csv").write_text(SENDERS_CSV)
+    write_txt(directory / "1.txt", size, seed)
+    write_imessage_json(directory / "imessage.json", size, seed)
+    write_messenger_json(directory / "messenger.json", size, seed)
+    return directory
+
+
+def parse_size(value):
+    value = value.lower()
+    for suffix, factor in (("k", 10**3), ("m", 10**6)):
+        if value.endswith(suffix):
+            return int(float(value[:-1]) * factor)
+    return int(value)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write synthetic chat exports.")
+    parser.add_argument("directory")
+    parser.add_argument("--size", type=parse_size, default=10_000, help="messages per source, e.g. 10k or 2m")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    write_data_sources(args.directory, args.size, args.seed)
+    print(f"Wrote {args.size} messages per source to {args.directory}")
@@ -0,0 +1,41 @@
+import re
+
+# Reference implementations kept verbatim from before they were optimized.
+# run.py checks the current code against them on the whole synthetic corpus
+# and times both.
+
+
+def clean_message_content(content: str) -> str:
+    """Clean message content by removing reactions, link previews, file attachments, and handling edited text."""
+    # Remove reactions section
+    content = re.sub(r"Reactions:.*?(?=\n\n|\n$|$)", "", content, flags=re.DOTALL)
+
+    # Remove "This message responded to an earlier message."
+    content = re.sub(r"This message responded to an earlier message\.", "", content)
+
+    # Handle file attachments
+    file_pattern = r"/Users/.*?/([^/]+\.\w+)$"
+    file_matches = re.search(file_pattern, content, re.MULTILINE)
+    if file_matches:
+        filename = file_matches.group(1)
+        content = re.sub(
+            r"/Users/.*?\.\w+[\s\S]*?(?=\n\n|\n$|$)",
+            f"[sent file: {filename}]",
+            content,
+        )
+
+    # Remove link previews
+    content = re.sub(
+        r"(https?://\S+)\n[^h].*?(?=\n\n|\n$|$)", r"\1", content, flags=re.DOTALL
+    )
+
+    # Clean up extra whitespace
+    content = re.sub(r"\n{3,}", "\n\n", content)
+    content = content.strip()
+
+    # If there's an edited section, use only the text after "Edited ...:"
+    edited_match = re.search(r"Edited\s.*?:\s*(.+)", content, flags=re.DOTALL)
+    if edited_match:
+        content = edited_match.group(1).strip()
+
+    return content
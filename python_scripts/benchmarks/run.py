@@ -0,0 +1,194 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+SCRIPTS_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SCRIPTS_DIR))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import reference
+from generate import parse_size, write_data_sources
+
+# Runs the pipeline stages against synthetic data and writes the timings to
+# a JSON file, optionally comparing them with an earlier run:
+#
+#   python3 benchmarks/run.py --size 100k
+#   python3 benchmarks/run.py --size 100k --compare benchmarks/results/before.json
+#
+# The pipeline scripts read and write ../data_sources and ../output, so the
+# benchmarks run from a scratch directory laid out the same way.
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+
+class Runner:
+    def __init__(self, repeat):
+        self.repeat = repeat
+        self.results = {}
+
+    def bench(self, name, fn, records=None):
+        """Time `fn` (best of `repeat`); `records` may be a callable of its result."""
+        best = None
+        result = None
+        for _ in range(self.repeat):
+            start = time.perf_counter()
+            result = fn()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        if callable(records):
+            records = records(result)
+        entry = {"seconds": best}
+        if records is not None:
+            entry["records"] = records
+            entry["per_second"] = records / best if best else None
+        self.results[name] = entry
+        rate = f"  {entry['per_second']:,.0f}/s" if records else ""
+        print(f"{name:<48} {best:9.4f}s{rate}")
+        return result
+
+
+def run_benchmarks(runner):
+    import imessage
+    import imessage_json
+    import merge
+    import messenger
+    from message import load_messages_from_merged
+    from metrics import METRICS, run_metrics
+
+    senders_map = imessage.load_senders_map("../data_sources/senders.csv")
+    with open("../data_sources/1.txt", "r", encoding="utf-8") as f:
+        content = f.read()
+
+    # record what parse_messages hands to the cleaner, for the cleaner benchmark
+    corpus = []
+    clean = imessage.clean_message_content
+    imessage.clean_message_content = lambda c: corpus.append(c) or clean(c)
+    try:
+        imessage.parse_messages(content, senders_map)
+    finally:
+        imessage.clean_message_content = clean
+
+    runner.bench("imessage.parse_messages", lambda: imessage.parse_messages(content, senders_map), len)
+    cleaned = runner.bench("imessage.clean_message_content", lambda: [clean(c) for c in corpus], len)
+    expected = runner.bench(
+        "reference.clean_message_content", lambda: [reference.clean_message_content(c) for c in corpus], len
+    )
+    check_parity("clean_message_content", cleaned, expected)
+    runner.bench("imessage_json.main", imessage_json.main)
+
+    with open("../data_sources/messenger.json", "r", encoding="utf-8") as f:
+        messenger_dict = json.loads(f.read())
+    messages = runner.bench("messenger.parse_messenger_json", lambda: list(messenger.parse_messenger_json(messenger_dict)), len)
+    messenger.write_to_json(messages)
+
+    runner.bench("merge.main", merge.main)
+    store = runner.bench("load_messages_from_merged", load_messages_from_merged, len)
+
+    for name, cls in METRICS.items():
+        runner.bench(f"metric.{name}", lambda: run_metrics(store, [cls()]), len(store))
+    runner.bench("metrics.run_metrics (all)", lambda: run_metrics(store), len(store))
+
+
+class ParityError(Exception):
+    pass
+
+
+def check_parity(name, actual, expected):
+    mismatches = [i for i, (a, e) in enumerate(zip(actual, expected)) if a != e]
+    if len(actual) != len(expected) or mismatches:
+        raise ParityError(f"{name}: {len(mismatches)} of {len(expected)} outputs differ from the reference")
+    print(f"{name}: output identical to the reference on {len(expected)} inputs")
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=SCRIPTS_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def optional_version(module):
+    try:
+        return __import__(module).__version__
+    except (ImportError, AttributeError):
+        return None
+
+
+def compare(results, baseline_path, threshold):
+    """Print per-benchmark ratios against a previous results file; return the regressions."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)["benchmarks"]
+    regressions = []
+    print(f"\nCompared with {baseline_path}:")
+    for name, entry in results.items():
+        old = baseline.get(name)
+        if old is None:
+            continue
+        ratio = entry["seconds"] / old["seconds"] if old["seconds"] else float("inf")
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:<48} {old['seconds']:9.4f}s -> {entry['seconds']:9.4f}s  x{ratio:.2f}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the message pipeline on synthetic data.")
+    parser.add_argument("--size", type=parse_size, default=10_000, help="messages per source, e.g. 10k or 2m")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="results file (default: benchmarks/results/<size>-<time>.json)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="slowdown that counts as a regression")
+    args = parser.parse_args()
+
+    runner = Runner(args.repeat)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="nmdb-bench-") as workspace:
+        workspace = Path(workspace)
+        print(f"Generating {args.size} messages per source...")
+        write_data_sources(workspace / "data_sources", args.size, args.seed)
+        (workspace / "output").mkdir()
+        (workspace / "python_scripts").mkdir()
+        os.chdir(workspace / "python_scripts")
+        try:
+            run_benchmarks(runner)
+        finally:
+            os.chdir(cwd)
+
+    report = {
+        "meta": {
+            "size": args.size,
+            "seed": args.seed,
+            "repeat": args.repeat,
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "git": git_revision(),
+            "python": platform.python_version(),
+            "numpy": optional_version("numpy"),
+            "orjson": optional_version("orjson"),
+        },
+        "benchmarks": runner.results,
+    }
+    output = Path(args.output) if args.output else RESULTS_DIR / f"{args.size}-{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with output.open("w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.compare and compare(runner.results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import hashlib
+import re
+from collections import deque
+
+from message import timestamp_to_epoch
+
+# Dedup pass merge.py runs over the merged stream.
+#
+# A record is a duplicate if
+#   * a record with its id was already emitted (overlapping exports of the
+#     same source, e.g. two devices' imessage.json), or
+#   * a message with the same normalized content (sender + casefolded,
+#     whitespace-collapsed text) from a *different* source was emitted
+#     within `window` seconds (the same message arriving via both iMessage
+#     and Messenger, or via a txt and a JSON export).
+#
+# The stream is in time order and both kinds of duplicate are at most
+# `window` seconds apart (copies with the same id share their timestamp),
+# so only the records emitted in the last `window` seconds are kept, in
+# dicts keyed by id and by content hash. Each record costs a couple of
+# dict lookups and memory doesn't grow with the history; every merge
+# starts from the sources, so there's nothing to carry between runs.
+
+DEFAULT_WINDOW = 120
+
+WHITESPACE_RE = re.compile(r'\s+')
+
+
+def content_key(record) -> str:
+    text = WHITESPACE_RE.sub(' ', record['message']).strip().casefold()
+    normalized = f"{record['sender'].casefold()}\x00{text}"
+    return hashlib.sha1(normalized.encode()).hexdigest()
+
+
+def source_of(record) -> str:
+    message_id = record['id']
+    for prefix in ('imessage', 'messenger'):
+        if message_id.startswith(prefix + '-'):
+            return prefix
+    # content-hash ids come from the txt exports
+    return 'imessage-txt'
+
+
+class DedupIndex:
+    def __init__(self, window=DEFAULT_WINDOW):
+        self.window = window
+        # (ts, id, content key) of the emitted records still in the window
+        self.recent = deque()
+        self.ids = set()
+        # content key -> [(ts, source)] of those records, oldest first
+        self.keys = {}
+        self.duplicates = 0
+
+    def _expire(self, ts):
+        recent = self.recent
+        while recent and recent[0][0] < ts - self.window:
+            _, message_id, key = recent.popleft()
+            self.ids.discard(message_id)
+            entries = self.keys[key]
+            entries.pop(0)
+            if not entries:
+                del self.keys[key]
+
+    def is_duplicate(self, record) -> bool:
+        ts = timestamp_to_epoch(record['timestamp'])
+        self._expire(ts)
+        if record['id'] in self.ids:
+            return True
+
+        key = content_key(record)
+        source = source_of(record)
+        entries = self.keys.get(key)
+        if entries is not None and any(other != source for _, other in entries):
+            return True
+
+        self.recent.append((ts, record['id'], key))
+        self.ids.add(record['id'])
+        self.keys.setdefault(key, []).append((ts, source))
+        return False
+
+    def filter(self, records):
+        """Yield the non-duplicate records of a time-ordered stream."""
+        self.duplicates = 0
+        for record in records:
+            if self.is_duplicate(record):
+                self.duplicates += 1
+            else:
+                yield record
@@ -0,0 +1,54 @@
+from dedup import DedupIndex
+
+
+def record(message_id, timestamp, message='see you at 8', sender='Alex'):
+    return {'id': message_id, 'message': message, 'sender': sender, 'timestamp': timestamp}
+
+
+IMESSAGE = record('imessage-1', '2024-03-01 20:00:00')
+MESSENGER = record('messenger-1', '2024-03-01 20:00:30')
+
+
+def dedup(records, window=120):
+    return [r['id'] for r in DedupIndex(window=window).filter(records)]
+
+
+def test_cross_source_duplicate():
+    assert dedup([IMESSAGE, MESSENGER]) == ['imessage-1']
+
+
+def test_same_id_twice():
+    assert dedup([IMESSAGE, IMESSAGE]) == ['imessage-1']
+
+
+def test_same_source_same_text_is_kept():
+    again = record('imessage-2', '2024-03-01 20:00:10')
+    assert dedup([IMESSAGE, again]) == ['imessage-1', 'imessage-2']
+
+
+def test_outside_window():
+    later = record('messenger-1', '2024-03-01 20:05:00')
+    assert dedup([IMESSAGE, later]) == ['imessage-1', 'messenger-1']
+
+
+def test_normalized_content():
+    shouted = record('messenger-1', '2024-03-01 20:00:30', message='  See you\n at 8 ')
+    assert dedup([IMESSAGE, shouted]) == ['imessage-1']
+
+
+def test_window_slides():
+    # each copy is within the window of the emitted one before it, but the
+    # expired ones no longer count
+    records = [
+        record('imessage-1', '2024-03-01 20:00:00'),
+        record('imessage-2', '2024-03-01 20:03:00'),
+        record('messenger-1', '2024-03-01 20:04:00'),
+        record('messenger-2', '2024-03-01 20:08:00'),
+    ]
+    assert dedup(records) == ['imessage-1', 'imessage-2', 'messenger-2']
+
+
+def test_duplicate_count():
+    index = DedupIndex()
+    assert len(list(index.filter([IMESSAGE, IMESSAGE, MESSENGER]))) == 1
+    assert index.duplicates == 2
@@ -0,0 +1,103 @@
+import heapq
+import os
+import pickle
+import struct
+import tempfile
+import zlib
+
+# Sorting that doesn't need everything in memory at once, shared by the
+# parsers, ingest.py and the response-time analytics.
+#
+# Items are buffered until they'd take up about `memory_mb`, then sorted
+# and written to a temporary run file as zlib-compressed pickled batches;
+# iterating merges the runs back with heapq.merge, holding one batch per
+# run. Inputs that fit in the budget never touch the disk and come out of
+# a plain list.sort. The sort is stable like list.sort: runs hold
+# consecutive input and heapq.merge prefers earlier runs on ties.
+#
+# The budget is a rough one: the size of an item is guessed from the
+# pickled size of the first few, times a fudge factor for Python's object
+# overhead. NMDB_SORT_MEMORY_MB changes the default, NMDB_SORT_TMPDIR
+# where the runs go.
+
+DEFAULT_MEMORY_MB = int(os.environ.get('NMDB_SORT_MEMORY_MB', 256))
+TMP_DIR = os.environ.get('NMDB_SORT_TMPDIR')
+BATCH_SIZE = 1024
+# items pickled to estimate the size of one
+SAMPLE_SIZE = 256
+# live objects take up a few times their pickled size
+OBJECT_OVERHEAD = 4
+LENGTH = struct.Struct('<I')
+
+
+def _read_run(f):
+    f.seek(0)
+    while True:
+        header = f.read(LENGTH.size)
+        if not header:
+            return
+        length, = LENGTH.unpack(header)
+        yield from pickle.loads(zlib.decompress(f.read(length)))
+
+
+class SpillingSorter:
+    def __init__(self, key, max_items=None, memory_mb=None, tmp_dir=None):
+        self.key = key
+        self.budget = (DEFAULT_MEMORY_MB if memory_mb is None else memory_mb) * 2**20
+        # `max_items` caps the buffer regardless of the estimate
+        self.max_items = max_items
+        # set once there are enough items to estimate their size
+        self.limit = None
+        self.tmp_dir = TMP_DIR if tmp_dir is None else tmp_dir
+        self.buffer = []
+        self.runs = []
+
+    def _estimate_limit(self):
+        sample = self.buffer[:SAMPLE_SIZE]
+        item_size = len(pickle.dumps(sample, pickle.HIGHEST_PROTOCOL)) / len(sample) * OBJECT_OVERHEAD
+        limit = max(BATCH_SIZE, int(self.budget / item_size))
+        self.limit = limit if self.max_items is None else min(limit, self.max_items)
+
+    def add(self, item):
+        self.buffer.append(item)
+        if self.limit is None and len(self.buffer) == SAMPLE_SIZE:
+            self._estimate_limit()
+        limit = self.limit or self.max_items
+        if limit is not None and len(self.buffer) >= limit:
+            self._spill()
+
+    def extend(self, items):
+        for item in items:
+            self.add(item)
+
+    def _spill(self):
+        self.buffer.sort(key=self.key)
+        run = tempfile.TemporaryFile(dir=self.tmp_dir)
+        # one load per batch when merging
+        for i in range(0, len(self.buffer), BATCH_SIZE):
+            data = zlib.compress(pickle.dumps(self.buffer[i:i + BATCH_SIZE], pickle.HIGHEST_PROTOCOL), 1)
+            run.write(LENGTH.pack(len(data)))
+            run.write(data)
+        self.runs.append(run)
+        self.buffer = []
+
+    def __iter__(self):
+        if not self.runs:
+            self.buffer.sort(key=self.key)
+            yield from self.buffer
+            return
+        if self.buffer:
+            self._spill()
+        try:
+            yield from heapq.merge(*(_read_run(run) for run in self.runs), key=self.key)
+        finally:
+            for run in self.runs:
+                run.close()
+            self.runs = []
+
+
+def sort_by(items, key, **options):
+    """Iterate over `items` sorted by `key`, spilling to disk past the budget."""
+    sorter = SpillingSorter(key, **options)
+    sorter.extend(items)
+    return iter(sorter)
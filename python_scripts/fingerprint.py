@@ -0,0 +1,41 @@
+import hashlib
+import os
+
+# Cheap identity of a file, for telling whether something derived from it
+# is still current: its size, mtime, and a hash of its first and last 64KB.
+# parse_cache.py keys cached exports on it; the side files merge.py writes
+# next to merged.jsonl (time_index.py, archive.py, search_index.py,
+# message_db.py, mmap_reader.py's merged.lines) store its `digest` and are
+# ignored once merged.jsonl no longer matches.
+
+BLOCK_SIZE = 1 << 16
+
+
+def block_hash(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def read_block(f, end):
+    """The BLOCK_SIZE bytes before `end`."""
+    start = max(end - BLOCK_SIZE, 0)
+    f.seek(start)
+    return f.read(end - start)
+
+
+def fingerprint(path) -> dict:
+    stat = os.stat(path)
+    with open(path, 'rb') as f:
+        head = f.read(BLOCK_SIZE)
+        tail = read_block(f, stat.st_size)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'head': block_hash(head), 'tail': block_hash(tail)}
+
+
+def digest(path) -> str:
+    """The fingerprint as one 32-character hex string, for fixed-size headers."""
+    fp = fingerprint(path)
+    return block_hash(f"{fp['size']} {fp['mtime_ns']} {fp['head']} {fp['tail']}".encode())
+
+
+def matches(path, expected) -> bool:
+    """Whether `path` exists and still has the digest `expected`."""
+    return expected is not None and os.path.exists(path) and digest(path) == expected
@@ -2,7 +2,7 @@ import json
 import re
 import csv
 from datetime import datetime
-from typing import List, Dict
+from typing import Dict, Iterable, Iterator, List, Optional
 import sys
 
 from message import Message
@@ -19,68 +19,96 @@ def load_senders_map(csv_path: str) -> Dict[str, str]:
     return senders_map
 
 
+# Compiled once at import. Each pattern below only runs when its fast-path
+# substring check says it could match, so plain text messages (most of
+# them) skip the regex engine entirely.
+
+# Reactions sections and the reply marker are removed in one scan; neither
+# removal can create a new match for the other, so this is the same as
+# doing them one after the other.
+REACTIONS_OR_REPLY_RE = re.compile(
+    r"Reactions:.*?(?=\n\n|\n$|$)|This message responded to an earlier message\.", re.DOTALL
+)
+FILE_NAME_RE = re.compile(r"/Users/.*?/([^/]+\.\w+)$", re.MULTILINE)
+FILE_BLOCK_RE = re.compile(r"/Users/.*?\.\w+[\s\S]*?(?=\n\n|\n$|$)")
+LINK_PREVIEW_RE = re.compile(r"(https?://\S+)\n[^h].*?(?=\n\n|\n$|$)", re.DOTALL)
+BLANK_LINES_RE = re.compile(r"\n{3,}")
+EDITED_RE = re.compile(r"Edited\s.*?:\s*(.+)", re.DOTALL)
+
+
 def clean_message_content(content: str) -> str:
     """Clean message content by removing reactions, link previews, file attachments, and handling edited text."""
-    # Remove reactions section
-    content = re.sub(r"Reactions:.*?(?=\n\n|\n$|$)", "", content, flags=re.DOTALL)
-
-    # Remove "This message responded to an earlier message."
-    content = re.sub(r"This message responded to an earlier message\.", "", content)
+    # Remove reactions sections and "This message responded to an earlier message."
+    if "Reactions:" in content or "This message responded" in content:
+        content = REACTIONS_OR_REPLY_RE.sub("", content)
 
     # Handle file attachments
-    file_pattern = r"/Users/.*?/([^/]+\.\w+)$"
-    file_matches = re.search(file_pattern, content, re.MULTILINE)
-    if file_matches:
-        filename = file_matches.group(1)
-        content = re.sub(
-            r"/Users/.*?\.\w+[\s\S]*?(?=\n\n|\n$|$)",
-            f"[sent file: {filename}]",
-            content,
-        )
+    if "/Users/" in content:
+        file_matches = FILE_NAME_RE.search(content)
+        if file_matches:
+            filename = file_matches.group(1)
+            content = FILE_BLOCK_RE.sub(f"[sent file: {filename}]", content)
 
     # Remove link previews
-    content = re.sub(
-        r"(https?://\S+)\n[^h].*?(?=\n\n|\n$|$)", r"\1", content, flags=re.DOTALL
-    )
+    if "http" in content:
+        content = LINK_PREVIEW_RE.sub(r"\1", content)
 
     # Clean up extra whitespace
-    content = re.sub(r"\n{3,}", "\n\n", content)
+    if "\n\n\n" in content:
+        content = BLANK_LINES_RE.sub("\n\n", content)
     content = content.strip()
 
     # If there's an edited section, use only the text after "Edited ...:"
-    edited_match = re.search(r"Edited\s.*?:\s*(.+)", content, flags=re.DOTALL)
-    if edited_match:
-        content = edited_match.group(1).strip()
+    if "Edited" in content:
+        edited_match = EDITED_RE.search(content)
+        if edited_match:
+            content = edited_match.group(1).strip()
 
     return content
 
 
-def parse_messages(content: str, senders_map: Dict[str, str]) -> List[Message]:
-    messages = []
+# Updated regex to enforce that nothing extra is on the line.
+TIMESTAMP_RE = re.compile(r"^(\w+ \d{1,2}, \d{4}\s+\d{1,2}:\d{2}:\d{2}(?: [APM]{2})?)(?: \(.*?\))?\s*$")
+
+
+def _complete_message(timestamp, sender, current_message, senders_map) -> Optional[Message]:
+    if not (timestamp and sender and current_message):
+        return None
+    message_content = "\n".join(current_message)
+    clean_content = clean_message_content(message_content.strip())
+    if not clean_content:
+        return None
+    dt = datetime.strptime(timestamp, "%b %d, %Y %I:%M:%S %p")
+    actual_sender = senders_map.get(sender, sender)
+    return Message(actual_sender, clean_content, dt)
+
+
+def iter_messages(lines: Iterable[str], senders_map: Dict[str, str]) -> Iterator[Message]:
+    """
+    Parse an export line by line, yielding each message as soon as its block
+    ends, so only the message being assembled is held in memory. `lines`
+    can be an open file.
+    """
     current_message = []
     timestamp = None
     sender = None
     had_nested = False  # Flag to mark if a nested block was encountered
 
-    # Updated regex to enforce that nothing extra is on the line.
-    timestamp_pattern = r"^(\w+ \d{1,2}, \d{4}\s+\d{1,2}:\d{2}:\d{2}(?: [APM]{2})?)(?: \(.*?\))?\s*$"
-
-    lines = content.split("\n")
-
     for line in lines:
+        if line.endswith("\n"):
+            line = line[:-1]
         if not line.strip():
             continue
 
-        timestamp_match = re.match(timestamp_pattern, line)
+        # every timestamp line has ", " and ":", cheap to check before matching
+        timestamp_match = None
+        if ", " in line and ":" in line:
+            timestamp_match = TIMESTAMP_RE.match(line)
         if timestamp_match:
-            # Save the previous message if it exists.
-            if timestamp and sender and current_message:
-                message_content = "\n".join(current_message)
-                clean_content = clean_message_content(message_content.strip())
-                if clean_content:
-                    dt = datetime.strptime(timestamp, "%b %d, %Y %I:%M:%S %p")
-                    actual_sender = senders_map.get(sender, sender)
-                    messages.append(Message(actual_sender, clean_content, dt))
+            # Emit the previous message if it exists.
+            message = _complete_message(timestamp, sender, current_message, senders_map)
+            if message:
+                yield message
             # Reset for the new message.
             timestamp = timestamp_match.group(1)
             current_message = []
@@ -99,20 +127,31 @@ def parse_messages(content: str, senders_map: Dict[str, str]) -> List[Message]:
                 if had_nested:
                     continue
                 current_message.append(line)
-    # Save the final message.
-    if timestamp and sender and current_message:
-        message_content = "\n".join(current_message)
-        clean_content = clean_message_content(message_content.strip())
-        if clean_content:
-            dt = datetime.strptime(timestamp, "%b %d, %Y %I:%M:%S %p")
-            actual_sender = senders_map.get(sender, sender)
-            messages.append(Message(actual_sender, clean_content, dt))
-    return messages
-
-
-def write_to_json(messages: List[Message], json_filename: str):
+    # Emit the final message.
+    message = _complete_message(timestamp, sender, current_message, senders_map)
+    if message:
+        yield message
+
+
+def parse_messages(content: str, senders_map: Dict[str, str]) -> List[Message]:
+    return list(iter_messages(content.split("\n"), senders_map))
+
+
+def write_to_json(messages: Iterable[Message], json_filename: str) -> int:
+    """
+    Write messages as an indented JSON array, one element at a time, so a
+    generator is never materialized. Returns the number written.
+    """
+    count = 0
     with open(json_filename, "w", encoding="utf-8") as f:
-        json.dump([m.to_dict() for m in messages], f, indent=2)
+        f.write("[")
+        for m in messages:
+            f.write(",\n  " if count else "\n  ")
+            # same layout json.dump(..., indent=2) gives the whole list
+            f.write(json.dumps(m.to_dict(), indent=2).replace("\n", "\n  "))
+            count += 1
+        f.write("\n]" if count else "]")
+    return count
 
 
 def main(filename=None):
@@ -125,12 +164,9 @@ def main(filename=None):
     senders_map = load_senders_map("../data_sources/senders.csv")
 
     with open(filepath, "r", encoding="utf-8") as f:
-        content = f.read()
-    messages = parse_messages(content, senders_map)
-
-    write_to_json(messages, json_filename)
+        count = write_to_json(iter_messages(f, senders_map), json_filename)
 
-    print(f"Converted {len(messages)} messages to JSON format.")
+    print(f"Converted {count} messages to JSON format.")
 
 
 if __name__ == "__main__":
@@ -1,4 +1,7 @@
-import json
+import instrument
+from operator import itemgetter
+from extsort import SpillingSorter
+from json_stream import JsonStream, ijson, use_ijson
 from message import Message
 from imessage import load_senders_map, write_to_json
 import datetime
@@ -12,57 +15,134 @@ def apple_to_local_timestamp(apple_ts_ns):
     dt = apple_reference_date + datetime.timedelta(seconds=seconds_since_apple_epoch)
     return str(dt)
 
-def main():
-    senders_map = load_senders_map("../data_sources/senders.csv")
+def _is_kept(participants, senders_map):
+    # only the 1:1 conversation whose participants are all known senders
+    return (
+        participants is not None
+        and len(participants) == 2
+        and all(participant in senders_map for participant in participants)
+    )
+
+
+def _is_text(message):
+    return message['type'] == 'message' and message['text'] is not None
+
+
+def _kept_messages_stream(f, senders_map):
+    # pure-Python path, see json_stream.py
+    stream = JsonStream(f)
+    for _ in stream.iter_array():
+        participants = None
+        held = None
+        for key in stream.iter_object():
+            if key == 'participants':
+                participants = stream.read_value()
+            elif key != 'messages':
+                stream.skip_value()
+            elif participants is not None:
+                if _is_kept(participants, senders_map):
+                    for _ in stream.iter_array():
+                        message = stream.read_value()
+                        if _is_text(message):
+                            yield message
+                else:
+                    stream.skip_value()
+            else:
+                # messages before participants: hold on to them until we
+                # know whether this block is wanted
+                held = []
+                for _ in stream.iter_array():
+                    message = stream.read_value()
+                    if _is_text(message):
+                        held.append(message)
+        if held and _is_kept(participants, senders_map):
+            yield from held
 
-    with open('../data_sources/imessage.json') as f:
-        input_message_json = json.loads(f.read())
 
-    messages_to_process = []
+def _kept_messages_ijson(f, senders_map):
+    participants = None
+    held = []
+    builder = None
+    kept = None
+    for prefix, event, value in ijson.parse(f, use_float=True):
+        if prefix == 'item':
+            if event == 'start_map':
+                participants, held, kept = None, [], None
+            elif event == 'end_map' and held and _is_kept(participants, senders_map):
+                yield from held
+        elif prefix == 'item.participants':
+            if event == 'start_array':
+                participants = []
+            elif event == 'end_array':
+                kept = _is_kept(participants, senders_map)
+        elif prefix == 'item.participants.item':
+            participants.append(value)
+        elif prefix.startswith('item.messages.item') and kept is not False:
+            # skipped blocks only cost the event loop, no objects get built
+            if builder is None:
+                builder = ijson.ObjectBuilder()
+            builder.event(event, value)
+            if prefix == 'item.messages.item' and event == 'end_map':
+                message = builder.value
+                builder = None
+                if _is_text(message):
+                    if kept:
+                        yield message
+                    else:
+                        held.append(message)
 
-    for block in input_message_json:
-        participants = block.get('participants')
-        if participants is not None and len(participants) == 2:
-            add_messages = True
-            for participant in participants:
-                if participant not in senders_map:
-                    add_messages = False
-            if add_messages:
-                messages_to_process.extend(block.get('messages'))
 
-    messages_to_process.sort(key=lambda x: x['timestamp'])
+def parse_imessage_json(path, senders_map):
+    """
+    Stream the export: conversations we don't keep are skipped without
+    building objects, non-text messages are dropped on the fly, and the
+    kept ones are sorted by a sorter that spills to disk past a bound.
+    The messages come back as an iterator over the sorted run.
+    """
+    sorter = SpillingSorter(key=itemgetter('timestamp'))
+    with open(path, 'rb' if use_ijson() else 'r') as f:
+        if use_ijson():
+            sorter.extend(_kept_messages_ijson(f, senders_map))
+        else:
+            sorter.extend(_kept_messages_stream(f, senders_map))
+    return _unique_messages(sorter, senders_map)
 
-    messages = []
 
+def _unique_messages(sorted_messages, senders_map):
+    # copies of a message share its timestamp, so only the ids seen at the
+    # current timestamp need to be remembered
     id_set = set()
-    for message in messages_to_process:
-        message_type = message['type']
-        if message_type != 'message':
-            continue
-        txt = message['text']
-        if txt is None:
-            continue
-        txt = txt.replace('\ufffc', '')
+    current_ts = None
+    for message in sorted_messages:
+        txt = message['text'].replace('\ufffc', '')
         if not txt:
             continue
 
         message_id = message['id']
+        ts = message['timestamp']
+        if ts != current_ts:
+            id_set.clear()
+            current_ts = ts
         if message_id in id_set:
             print(f'dupe id: {message_id}')
         else:
             id_set.add(message_id)
-            ts = message['timestamp']
             sender = message['sender']
-            messages.append(Message(
+            yield Message(
                 senders_map.get(sender, sender),
                 txt,
                 apple_to_local_timestamp(ts),
                 'imessage-' + message_id,
-            ))
+            )
 
 
-    # TODO: Count check
-    print(f'total # of messages: {len(messages)}')
-
-    write_to_json(messages, '../output/imessage.json')
+def main():
+    with instrument.run('imessage_json'):
+        senders_map = load_senders_map("../data_sources/senders.csv")
+        # the parsed messages stream straight into the file
+        with instrument.stage('parse_and_write') as stage:
+            messages = parse_imessage_json('../data_sources/imessage.json', senders_map)
+            stage.records = write_to_json(messages, '../output/imessage.json')
 
+        # TODO: Count check
+        print(f'total # of messages: {stage.records}')
@@ -4,6 +4,11 @@ import re
 import base64
 import json
 import sys
+from operator import attrgetter
+
+import message_db
+from extsort import SpillingSorter
+from mmap_reader import MergedFile
 
 file_prefix = '2'
 if len(sys.argv) > 1:
@@ -125,7 +130,7 @@ def parse_txt(all_messages: str) -> list:
             raise Exception(f'last message not complete\n{message_to_append}')
         messages.append(message_to_append)
 
-    ret_messages = []
+    ret_messages = SpillingSorter(key=attrgetter('timestamp'))
     # message post-processing
     for message in messages:
         did_something = False
@@ -153,13 +158,12 @@ def parse_txt(all_messages: str) -> list:
 
         if not message.message == 'This message responded to an earlier message.':
             # remove message case (inverse)
-            ret_messages.append(message)
+            ret_messages.add(message)
         if did_something:
             # TODO: make it so this is dumped into a file
             print(f'post_processing did something!\nold message: {old_message}\nnew message: {message.message}\n')
 
-    ret_messages.sort(key=lambda m: m.timestamp)
-    return ret_messages
+    return list(ret_messages)
 
 
 def find_message(messages, query):
@@ -168,6 +172,21 @@ def find_message(messages, query):
             print(message)
 
 
+def find_in_merged(query):
+    # the local store if it's up to date (message_db.py), otherwise a raw
+    # byte search of merged.jsonl (mmap_reader.py)
+    if message_db.fresh():
+        db = message_db.MessageDB()
+        for record in db.contains(query):
+            print(f"{record['timestamp']} {record['sender']}: {record['message']}")
+        db.close()
+    else:
+        merged = MergedFile()
+        for view in merged.grep(query):
+            print(view)
+        merged.close()
+
+
 def write_to_json(messages):
     # json_dict = {
     #     "messages": [m.to_dict() for m in messages],
@@ -0,0 +1,51 @@
+import pytest
+
+import imessage
+from benchmarks import reference
+from benchmarks.generate import SENDERS_CSV, write_txt
+
+EDGE_CASES = [
+    '',
+    'plain text',
+    'Reactions:\n    Loved by Me',
+    'before\nReactions:\n    Loved by Me\n\nafter',
+    'see Reactions: inline and This message responded to an earlier message. too',
+    'This message responded to an earlier message.\nReactions: twice\nReactions:\n',
+    '/Users/stephen/Library/Messages/Attachments/ab/12/IMG_0001.jpeg',
+    'look\n/Users/stephen/Library/Messages/Attachments/ab/12/my photo.HEIC\nmore\n\nafter',
+    '/Users/without/a/file',
+    'https://example.com/article\nExample Title\nexample.com',
+    'two https://a.example/x\nTitle A\n\nhttps://b.example/y\nhttps://c.example/z\nTitle C',
+    'http is not a link\nnext line',
+    'a\n\n\n\nb\n\n\nc',
+    'Edited 1 time: new text',
+    'Edited 2 times: first\nEdited 1 time: second',
+    'Edited without a colon',
+    'Reactions:\n    Liked\n\nEdited 1 time: https://example.com\nPreview\n\n/Users/x/y/z.pdf',
+    '  \n padded \n  ',
+]
+
+
+def exported_contents(tmp_path, monkeypatch, size=3000):
+    """What the txt parser hands the cleaner for a synthetic export."""
+    path = tmp_path / '1.txt'
+    write_txt(path, size, seed=3)
+    senders_map = dict(line.split(',') for line in SENDERS_CSV.splitlines())
+    contents = []
+    clean = imessage.clean_message_content
+    monkeypatch.setattr(imessage, 'clean_message_content', lambda content: contents.append(content) or clean(content))
+    imessage.parse_messages(path.read_text(encoding='utf-8'), senders_map)
+    monkeypatch.undo()
+    return contents
+
+
+@pytest.mark.parametrize('content', EDGE_CASES)
+def test_cleaner_matches_reference(content):
+    assert imessage.clean_message_content(content) == reference.clean_message_content(content)
+
+
+def test_cleaner_matches_reference_on_export(tmp_path, monkeypatch):
+    contents = exported_contents(tmp_path, monkeypatch)
+    assert len(contents) > 2000
+    cleaned = [imessage.clean_message_content(content) for content in contents]
+    assert cleaned == [reference.clean_message_content(content) for content in contents]
@@ -1,8 +1,12 @@
+import json
 import os
+import shlex
 import shutil
-import imessage_json
+import ingest
 import merge
 import imessage
+import instrument
+import publish
 
 senders_map = imessage.load_senders_map("../data_sources/senders.csv")
 
@@ -59,13 +63,54 @@ def imessage_export():
         print(f'Copied {source} to {destination}')
 
 
-imessage_export()
-imessage_json.main()
-merge.main()
-command = (
-    'cd ../frontend && '
-    '. ~/.nvm/nvm.sh && '
-    'nvm use 18 && '
-    'npx convex import --replace ../output/merged.jsonl --table messages'
-)
-os.system(command)
+CONVEX_PREFIX = 'cd ../frontend && . ~/.nvm/nvm.sh && nvm use 18 && '
+# ids per deleteByIds call, keeps the mutation and the command line small
+TOMBSTONE_BATCH = 500
+
+
+def convex(command):
+    print(command)
+    return os.system(CONVEX_PREFIX + command) == 0
+
+
+def upload(delta):
+    """Push the prepared delta to Convex; True if everything went through."""
+    if delta.full:
+        return convex(f'npx convex import --replace {publish.DELTA_PATH} --table messages')
+    for i in range(0, len(delta.tombstones), TOMBSTONE_BATCH):
+        batch = json.dumps({'ids': delta.tombstones[i:i + TOMBSTONE_BATCH]})
+        if not convex(f'npx convex run messages:deleteByIds {shlex.quote(batch)}'):
+            return False
+    if delta.added or delta.changed:
+        return convex(f'npx convex import --append {publish.DELTA_PATH} --table messages')
+    return True
+
+
+if __name__ == '__main__':
+    with instrument.run('import-imessage'):
+        with instrument.stage('export'):
+            imessage_export()
+        # every export in ../data_sources is parsed in parallel, see ingest.py
+        partials = ingest.main()
+        merge.main(partials)
+
+        # only upload what changed since the last import, see publish.py
+        manifest = publish.Manifest()
+        with instrument.stage('prepare_delta') as stage:
+            delta = manifest.prepare()
+            stage.records = delta.added + delta.changed
+        print(
+            f'{delta.added} new, {delta.changed} changed, {delta.unchanged} unchanged, '
+            f'{len(delta.tombstones)} to delete'
+        )
+        if delta.is_empty():
+            print('Nothing to upload')
+        else:
+            with instrument.stage('upload') as stage:
+                stage.records = delta.added + delta.changed
+                uploaded = upload(delta)
+            if uploaded:
+                manifest.commit()
+            else:
+                print('Upload failed; the next run will retry the same delta')
+        manifest.close()
@@ -0,0 +1,130 @@
+import json
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from operator import itemgetter
+from pathlib import Path
+
+import imessage
+import imessage_json
+import instrument
+import messenger
+import parse_cache
+from extsort import sort_by
+
+# Finds every source export under ../data_sources and parses them in
+# parallel, one process per source. Exports are recognized by name:
+# imessage*.json (imessage-exporter JSON), *messenger*.json, and the legacy
+# numbered txt exports (1.txt, 2.txt, ...). The txt exports hold the same
+# conversation as the JSON one, so they're only used when there's no
+# imessage*.json; other files are left alone. Each worker writes its messages, sorted
+# by timestamp, to ../output/partials/<source>.jsonl, which merge.py then
+# combines. Another device's export or a new conversation only adds to the
+# wall time if it's the biggest file.
+
+DATA_DIR = Path("../data_sources")
+PARTIALS_DIR = Path("../output/partials")
+NUMBERED_TXT_RE = re.compile(r"\d+\.txt")
+
+
+def source_kind(path: Path):
+    name = path.name.lower()
+    if NUMBERED_TXT_RE.fullmatch(name):
+        return "imessage-txt"
+    if path.suffix.lower() == ".json":
+        if "messenger" in name:
+            return "messenger"
+        if name.startswith("imessage"):
+            return "imessage-json"
+    return None
+
+
+def find_sources(data_dir=DATA_DIR):
+    """(kind, path) for every export in data_dir and its per-device subdirectories."""
+    data_dir = Path(data_dir)
+    candidates = list(data_dir.glob("*")) + list(data_dir.glob("*/*"))
+    sources = []
+    for path in sorted(candidates):
+        kind = source_kind(path)
+        if kind and path.is_file():
+            sources.append((kind, path))
+    if any(kind == "imessage-json" for kind, _ in sources):
+        # the txt exports would only add the same messages under other ids
+        sources = [(kind, path) for kind, path in sources if kind != "imessage-txt"]
+    return sources
+
+
+def partial_path(path: Path, data_dir=DATA_DIR, partials_dir=PARTIALS_DIR):
+    name = "__".join(path.relative_to(data_dir).parts)
+    return Path(partials_dir) / f"{name}.jsonl"
+
+
+def iter_txt_messages(path, senders_map):
+    with open(path, "r", encoding="utf-8") as f:
+        yield from imessage.iter_messages(f, senders_map)
+
+
+def parse_source(kind, path, senders_map):
+    """An iterator over the source's messages, streamed rather than collected in a list."""
+    if kind == "imessage-txt":
+        return iter_txt_messages(path, senders_map)
+    if kind == "imessage-json":
+        return imessage_json.parse_imessage_json(path, senders_map)
+    if kind == "messenger":
+        return messenger.parse_messenger_file(path)
+    raise ValueError(f"unknown source kind: {kind}")
+
+
+def ingest_source(kind, path, output, senders_map, cache=True):
+    """Worker: parse one source and write it as a time-sorted jsonl partial."""
+    if cache:
+        # unchanged exports come out of ../output/parse_cache, see parse_cache.py
+        name = output.name[:-len(".jsonl")]
+        records = parse_cache.cached_records(kind, path, senders_map, parse_source, name)
+    else:
+        records = (m.to_dict() for m in parse_source(kind, path, senders_map))
+    # stable, so messages with the same timestamp keep their export order;
+    # a big export spills sorted runs to disk instead of sorting in memory
+    records = sort_by(records, key=itemgetter("timestamp"))
+    count = 0
+    tmp = Path(str(output) + ".tmp")
+    with open(tmp, "w") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+            count += 1
+    tmp.replace(output)
+    return count
+
+
+def main(workers=None, data_dir=DATA_DIR, partials_dir=PARTIALS_DIR, cache=True):
+    """Parse every source in parallel; returns the partial files in a stable order."""
+    senders_map = imessage.load_senders_map(str(Path(data_dir) / "senders.csv"))
+    sources = find_sources(data_dir)
+    if not sources:
+        print(f"No sources found in {data_dir}")
+        return []
+
+    partials_dir = Path(partials_dir)
+    partials_dir.mkdir(parents=True, exist_ok=True)
+    for stale in partials_dir.glob("*.jsonl"):
+        stale.unlink()
+
+    # biggest first, so the longest parse starts right away
+    by_size = sorted(sources, key=lambda source: source[1].stat().st_size, reverse=True)
+    outputs = {path: partial_path(path, data_dir, partials_dir) for _, path in sources}
+    with instrument.run("ingest") as stage, ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(ingest_source, kind, path, outputs[path], senders_map, cache): path
+            for kind, path in by_size
+        }
+        stage.records = 0
+        for future in as_completed(futures):
+            stage.records += future.result()
+            print(f"Parsed {future.result()} messages from {futures[future]}")
+
+    return [outputs[path] for _, path in sources]
+
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if arg != "--no-cache"]
+    main(int(args[0]) if args else None, cache="--no-cache" not in sys.argv)
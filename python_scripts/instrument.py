@@ -0,0 +1,204 @@
+import contextlib
+import cProfile
+import glob
+import json
+import os
+import platform
+import re
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+# Stage timing for the pipeline scripts.
+#
+#   with instrument.run('merge'):
+#       with instrument.stage('write') as stage:
+#           ...
+#           stage.records = count
+#
+# Each stage records wall and CPU time, its record count and throughput,
+# and the process's peak RSS so far. A run is itself a stage; when the
+# outermost one exits, a JSON report is written to
+# ../output/reports/<run>-<time>.json and copied to <run>-latest.json.
+# Only the newest NMDB_REPORT_HISTORY reports per command are kept
+# (default 50, 0 keeps them all), along with their profiles. Runs nest:
+# when import-imessage.py calls merge.main, merge's stages land in the
+# import-imessage report as "import-imessage/merge/...".
+#
+# Set NMDB_PROFILE=cprofile or NMDB_PROFILE=tracemalloc to also profile each
+# stage. cProfile stats are dumped next to the report, one .prof per stage
+# (a parent's profile leaves out its child stages); tracemalloc adds the
+# stage's peak traced memory and its top allocation sites.
+#
+# `stage` outside of any `run` does nothing, so library code can be
+# instrumented without every caller opting in.
+
+REPORTS_DIR = Path('../output/reports')
+PROFILE_MODE = os.environ.get('NMDB_PROFILE', '')
+KEEP_REPORTS = int(os.environ.get('NMDB_REPORT_HISTORY') or 50)
+TOP_ALLOCATIONS = 10
+
+
+def peak_rss_mb(who=None):
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who is None else who)
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return round(usage.ru_maxrss * scale / 2**20, 1)
+
+
+class Stage:
+    def __init__(self, name):
+        self.name = name
+        self.records = None
+
+    def report(self, seconds, cpu_seconds):
+        entry = {'name': self.name, 'seconds': round(seconds, 4), 'cpu_seconds': round(cpu_seconds, 4)}
+        if self.records is not None:
+            entry['records'] = self.records
+            entry['per_second'] = round(self.records / seconds, 1) if seconds else None
+        entry['peak_rss_mb'] = peak_rss_mb()
+        return entry
+
+
+class Run:
+    def __init__(self, name):
+        self.name = name
+        self.started = datetime.now()
+        self.start = time.perf_counter()
+        self.stages = []
+        self.stack = []
+        self.profilers = []
+        self.label = f'{name}-{self.started:%Y%m%d-%H%M%S}'
+
+    def full_name(self, name):
+        return '/'.join(self.stack + [name])
+
+    def profile_path(self, stage_name, suffix):
+        return REPORTS_DIR / f"{self.label}.{stage_name.replace('/', '.')}{suffix}"
+
+    def report(self):
+        children = peak_rss_mb(resource.RUSAGE_CHILDREN) if resource else None
+        return {
+            'run': self.name,
+            'started': self.started.isoformat(timespec='seconds'),
+            'seconds': round(time.perf_counter() - self.start, 4),
+            'argv': sys.argv,
+            'python': platform.python_version(),
+            'profile': PROFILE_MODE or None,
+            'peak_rss_mb': peak_rss_mb(),
+            # worker processes, e.g. ingest.py's pool
+            'children_peak_rss_mb': children,
+            'stages': self.stages,
+        }
+
+    def write(self):
+        REPORTS_DIR.mkdir(parents=True, exist_ok=True)
+        path = REPORTS_DIR / f'{self.label}.json'
+        tmp_path = path.with_suffix('.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+        tmp_path.replace(path)
+        latest = REPORTS_DIR / f'{self.name}-latest.json'
+        tmp_path.write_bytes(path.read_bytes())
+        tmp_path.replace(latest)
+        self.prune()
+        print(f'Run report written to {path}')
+        return path
+
+    def prune(self):
+        """Remove all but the newest KEEP_REPORTS reports of this command, and their profiles."""
+        if KEEP_REPORTS <= 0:
+            return
+        pattern = re.compile(re.escape(self.name) + r'-\d{8}-\d{6}\.json')
+        # the timestamps sort in time order
+        reports = sorted(p for p in REPORTS_DIR.glob(f'{self.name}-*.json') if pattern.fullmatch(p.name))
+        for old in reports[:-KEEP_REPORTS]:
+            label = old.name[:-len('.json')]
+            for profile in REPORTS_DIR.glob(f'{glob.escape(label)}.*.prof'):
+                profile.unlink()
+            old.unlink()
+
+
+_current = None
+
+
+@contextlib.contextmanager
+def run(name):
+    """A stage that writes a report when it's the outermost one."""
+    global _current
+    if _current is not None:
+        with stage(name) as s:
+            yield s
+        return
+    _current = Run(name)
+    try:
+        with stage(name) as s:
+            yield s
+    finally:
+        current, _current = _current, None
+        current.write()
+
+
+@contextlib.contextmanager
+def stage(name):
+    current = _current
+    if current is None:
+        yield Stage(name)
+        return
+
+    s = Stage(current.full_name(name))
+    current.stack.append(name)
+    profiler = None
+    if PROFILE_MODE == 'cprofile':
+        # only one profiler can be active, the parent's pauses meanwhile
+        if current.profilers:
+            current.profilers[-1].disable()
+        profiler = cProfile.Profile()
+        current.profilers.append(profiler)
+        profiler.enable()
+    tracing = PROFILE_MODE == 'tracemalloc'
+    if tracing:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        # a child stage resets this again, the parent's peak is then
+        # counted from the child's start
+        tracemalloc.reset_peak()
+        snapshot_before = tracemalloc.take_snapshot()
+
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield s
+    finally:
+        seconds = time.perf_counter() - start
+        cpu_seconds = time.process_time() - cpu_start
+        current.stack.pop()
+        entry = s.report(seconds, cpu_seconds)
+
+        if profiler is not None:
+            profiler.disable()
+            current.profilers.pop()
+            if current.profilers:
+                current.profilers[-1].enable()
+            path = current.profile_path(s.name, '.prof')
+            path.parent.mkdir(parents=True, exist_ok=True)
+            profiler.dump_stats(path)
+            entry['profile'] = str(path)
+        if tracing:
+            entry['traced_peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+            stats = tracemalloc.take_snapshot().compare_to(snapshot_before, 'lineno')[:TOP_ALLOCATIONS]
+            entry['top_allocations'] = [
+                {'where': str(stat.traceback), 'size_kb': round(stat.size_diff / 1024, 1), 'count': stat.count_diff}
+                for stat in stats
+            ]
+        current.stages.append(entry)
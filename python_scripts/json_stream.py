@@ -0,0 +1,142 @@
+import json
+import re
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# Incremental reader for JSON documents too big to json.loads whole, like
+# the imessage-exporter dump of every conversation on a device.
+#
+# JsonStream walks the document a chunk at a time. The caller steers it:
+# `iter_array`/`iter_object` step through containers, `read_value` decodes
+# one (small) value with json's C decoder, and `skip_value` jumps over a
+# value of any size without building objects for it. Skipping only stops
+# in Python at brackets; strings and everything between brackets are
+# consumed by one regex match.
+#
+# If ijson is installed, the parsers use its C backend instead (see
+# `use_ijson`); JsonStream is the pure-Python fallback.
+
+CHUNK_SIZE = 1 << 20
+
+WHITESPACE_RE = re.compile(r'[ \t\n\r]*')
+# everything up to the next bracket, with strings taken whole
+SKIP_RE = re.compile(r'(?:[^"\[\]{}]+|"(?:[^"\\]|\\.)*")*', re.S)
+
+
+def use_ijson():
+    return ijson is not None
+
+
+class JsonStream:
+    def __init__(self, f, chunk_size=CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self, size=None):
+        """Drop what's before `pos` and read another chunk; False at EOF."""
+        chunk = self.f.read(size or self.chunk_size)
+        if not chunk:
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Next non-whitespace character, without consuming it ('' at EOF)."""
+        while True:
+            self.pos = WHITESPACE_RE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f'expected {char!r} in JSON document, found {found!r}')
+        self.pos += 1
+
+    def read_value(self):
+        self.peek()
+        # every retry decodes the value from its start again, so read ahead
+        # by twice as much each time to keep a big value linear
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                # most likely cut off by the end of the buffer
+                if not self._fill(size):
+                    raise
+                size *= 2
+                continue
+            # a number running into the end of the buffer may continue
+            if end == len(self.buf) and self._fill(size):
+                size *= 2
+                continue
+            self.pos = end
+            return value
+
+    def skip_value(self):
+        if self.peek() not in '[{':
+            self.read_value()
+            return
+        depth = 0
+        pos = self.pos
+        while True:
+            pos = SKIP_RE.match(self.buf, pos).end()
+            # an unterminated string at the end of the buffer stops the match
+            # too; either way more input is needed
+            if pos == len(self.buf) or self.buf[pos] == '"':
+                self.pos = pos
+                if not self._fill():
+                    raise ValueError('JSON document ends in the middle of a value')
+                pos = self.pos
+                continue
+            char = self.buf[pos]
+            pos += 1
+            if char in '[{':
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    self.pos = pos
+                    return
+
+    def iter_array(self):
+        """Step through an array; the loop body has to consume each element."""
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield
+            char = self.peek()
+            self.pos += 1
+            if char == ']':
+                return
+            if char != ',':
+                raise ValueError(f'expected "," or "]" in JSON array, found {char!r}')
+
+    def iter_object(self):
+        """Yield each key of an object; the loop body has to consume its value."""
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.read_value()
+            self.expect(':')
+            yield key
+            char = self.peek()
+            self.pos += 1
+            if char == '}':
+                return
+            if char != ',':
+                raise ValueError(f'expected "," or "}}" in JSON object, found {char!r}')
@@ -1,6 +1,9 @@
-import json
 from datetime import datetime, timedelta
 
+import message_db
+from message import to_epoch
+from mmap_reader import MergedFile
+
 def parse_date(date_str):
     return datetime.fromisoformat(date_str)
 
@@ -12,11 +15,27 @@ def get_messages_around_date(messages, target_date_str, days_range=1):
     filtered_messages = [m for m in messages if start_date <= parse_date(m['timestamp']) < end_date]
     return filtered_messages
 
+def query_messages_around_date(db, target_date_str, days_range=1):
+    # same window as get_messages_around_date, answered by the timestamp index
+    target_date = datetime.strptime(target_date_str, '%Y-%m-%d')
+    start_date = target_date - timedelta(days=days_range)
+    end_date = target_date + timedelta(days=days_range + 1)
+    return list(db.between(str(start_date), str(end_date)))
+
+def read_messages_around_date(merged, target_date_str, days_range=1):
+    # two bisects in the sidecar time index, and only the lines in the
+    # window get decoded
+    target_date = datetime.strptime(target_date_str, '%Y-%m-%d')
+    start_date = target_date - timedelta(days=days_range)
+    end_date = target_date + timedelta(days=days_range + 1)
+    return [view.record for view in merged.window(to_epoch(start_date), to_epoch(end_date))]
+
 def print_messages_grouped_by_day(messages):
     messages_by_day = {}
     
     for message in messages:
-        date_str = parse_date(message['timestamp']).strftime('%Y-%m-%d')
+        # timestamps start with the date, no need to parse them
+        date_str = message['timestamp'][:10]
         if date_str not in messages_by_day:
             messages_by_day[date_str] = []
         messages_by_day[date_str].append(message)
@@ -29,13 +48,27 @@ def print_messages_grouped_by_day(messages):
 
 import sys
 def main():
-    with open('../output/merged.json', 'r') as f:
-        messages = json.load(f)
+    merged = MergedFile()
+    if sys.argv[1] in ('--grep', '--sender'):
+        # raw byte search over the mapped file, only hits get decoded
+        if sys.argv[1] == '--grep':
+            views = merged.grep(' '.join(sys.argv[2:]))
+        else:
+            views = merged.by_sender(sys.argv[2])
+        print_messages_grouped_by_day([view.record for view in views])
+        merged.close()
+        return
 
     target_date = sys.argv[1]
     days_range = int(sys.argv[2])
-    
-    around_messages = get_messages_around_date(messages, target_date, days_range)
+
+    if merged.index is None and message_db.fresh():
+        db = message_db.MessageDB()
+        around_messages = query_messages_around_date(db, target_date, days_range)
+        db.close()
+    else:
+        around_messages = read_messages_around_date(merged, target_date, days_range)
+    merged.close()
     print_messages_grouped_by_day(around_messages)
 
 if __name__ == "__main__":
@@ -1,19 +1,126 @@
+import heapq
 import json
+import os
+import sys
+from operator import itemgetter
 
-def main():
-    with open('../output/imessage.json', 'r') as f:
-        c1 = f.read()
-    with open('../output/messenger.json', 'r') as f:
-        c3 = f.read()
+import fingerprint
+import instrument
+import message_db
+import search_index
+from archive import ArchiveWriter
+from dedup import DedupIndex
+from message import MERGED_PATH
+from time_index import TimeIndexWriter
 
-    j1 = json.loads(c1)
-    j3 = json.loads(c3)
-    m = j1 + j3
+DEFAULT_SOURCES = ['../output/imessage.json', '../output/messenger.json']
 
-    with open('../output/merged.jsonl', 'w') as f:
-        for message in m:
-            f.write(json.dumps(message) + '\n')
+# Each source is treated as a run already sorted by timestamp and they're
+# k-way merged into merged.jsonl, holding one record per source at a time.
+# The output is globally time-ordered, so consumers don't need to re-sort.
+# Timestamps are "%Y-%m-%d %H:%M:%S" strings, which sort chronologically.
+
+by_timestamp = itemgetter('timestamp')
+
+
+def read_records(path):
+    # per-source outputs are either a JSON array or, from ingest.py, jsonl
+    with open(path, 'r') as f:
+        if path.endswith('.jsonl'):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            # JSON arrays have to be loaded whole anyway; sort them in case an
+            # older writer didn't
+            yield from sorted(json.loads(f.read()), key=by_timestamp)
+
+
+def check_sorted(records, path):
+    prev = None
+    for record in records:
+        ts = record['timestamp']
+        if prev is not None and ts < prev:
+            raise ValueError(f'{path} is not sorted by timestamp ({ts} after {prev})')
+        prev = ts
+        yield record
+
+
+def merge_sources(sources):
+    runs = [check_sorted(read_records(str(path)), path) for path in sources]
+    # ties keep source order, heapq.merge is stable
+    return heapq.merge(*runs, key=by_timestamp)
+
+
+def main(sources=None, dedup=True, db=None, search=None):
+    if sources is None:
+        sources = DEFAULT_SOURCES
+
+    with instrument.run('merge'):
+        records = merge_sources(sources)
+        index = None
+        if dedup:
+            # drops messages seen twice across overlapping exports, see dedup.py
+            index = DedupIndex()
+            records = index.filter(records)
+
+        # (epoch, byte offset) per line for date-window lookups, see time_index.py
+        index_writer = TimeIndexWriter()
+        # binary copy with a fixed-width record table, see archive.py
+        archive_writer = ArchiveWriter()
+        if search is None:
+            # like the SQLite store, kept up to date once it's been built
+            search = os.path.exists(search_index.INDEX_PATH)
+        # token -> posting list index for keyword search, see search_index.py
+        search_writer = search_index.SearchIndexWriter() if search else None
+        with instrument.stage('write') as stage:
+            count = 0
+            with open(MERGED_PATH, 'w') as f:
+                for message in records:
+                    line = json.dumps(message) + '\n'
+                    f.write(line)
+                    # json.dumps escapes non-ASCII, so characters == bytes
+                    index_writer.add(message['timestamp'], len(line))
+                    if archive_writer:
+                        try:
+                            archive_writer.add(message)
+                        except ValueError as e:
+                            # e.g. a timestamp the archive format can't hold;
+                            # the old archive's digest won't match, so it's ignored
+                            print(f'Not writing {archive_writer.path}: {e}')
+                            archive_writer.abort()
+                            archive_writer = None
+                    if search_writer:
+                        search_writer.add(message)
+                    count += 1
+            # the side files are only used while merged.jsonl still matches this
+            merged_digest = fingerprint.digest(MERGED_PATH)
+            index_writer.write(merged_digest)
+            if archive_writer:
+                archive_writer.close(merged_digest)
+            if search_writer:
+                search_writer.write(merged_digest)
+            stage.records = count
+        print(f'Merged {count} messages from {len(sources)} sources')
+        if index:
+            print(f'Skipped {index.duplicates} duplicates')
+        if db is None:
+            # once the store has been built it's kept up to date
+            db = os.path.exists(message_db.DB_PATH)
+        if db:
+            # optional SQLite copy for range/keyword lookups, see message_db.py
+            with instrument.stage('message_db') as stage:
+                stage.records = message_db.build_from_merged()
+            print(f'Wrote {stage.records} messages to {message_db.DB_PATH}')
 
 
 if __name__ == '__main__':
-    main()
+    args = sys.argv[1:]
+    flags = {'--no-dedup', '--db', '--search'}
+    sources = [arg for arg in args if arg not in flags]
+    main(
+        sources or None,
+        dedup='--no-dedup' not in args,
+        db=True if '--db' in args else None,
+        search=True if '--search' in args else None,
+    )
@@ -1,10 +1,20 @@
+from array import array
+from collections import Counter
 from dataclasses import dataclass, field
-from datetime import datetime
+from datetime import date, datetime, timedelta
 import base64
 import hashlib
 import json
 from typing import Optional
 
+import vectorized
+
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
 @dataclass
 class Message:
     sender: str
@@ -25,7 +35,7 @@ class Message:
 
     @staticmethod
     def from_dict(data: dict):
-        timestamp = datetime.strptime(data['timestamp'], "%Y-%m-%d %H:%M:%S")
+        timestamp = parse_timestamp(data['timestamp'])
         return Message(sender=data['sender'], message=data['message'], timestamp=timestamp)
 
     # Dict that's used for JSON serialization
@@ -39,9 +49,230 @@ class Message:
             "timestamp": str(self.timestamp),
         }
 
-def load_messages_from_merged():
-    messages = []
-    with open('../output/merged.jsonl', 'r') as f:
-        for line in f.readlines():
-            messages.append(Message.from_dict(json.loads(line)))
-    return messages
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def parse_timestamp(ts: str) -> datetime:
+    # Fixed "%Y-%m-%d %H:%M:%S" layout, sliced by offset; a lot cheaper than
+    # strptime. Anything else (microseconds, from the JSON exports) goes
+    # through fromisoformat, so str() of the result gives `ts` back.
+    if len(ts) != 19:
+        return datetime.fromisoformat(ts)
+    return datetime(
+        int(ts[0:4]), int(ts[5:7]), int(ts[8:10]),
+        int(ts[11:13]), int(ts[14:16]), int(ts[17:19]),
+    )
+
+
+_epoch_days = {}
+
+
+def timestamp_to_epoch(ts: str) -> int:
+    """Same as to_epoch(parse_timestamp(ts)) without building a datetime."""
+    day = _epoch_days.get(ts[:10])
+    if day is None:
+        day = date(int(ts[0:4]), int(ts[5:7]), int(ts[8:10])).toordinal() - EPOCH_ORDINAL
+        _epoch_days[ts[:10]] = day
+    return day * 86400 + int(ts[11:13]) * 3600 + int(ts[14:16]) * 60 + int(ts[17:19])
+
+
+def to_epoch(dt: datetime) -> int:
+    # Timestamps are naive local times; they're stored as seconds since a
+    # naive 1970-01-01 so hour/day arithmetic never has to think about zones.
+    return (dt.toordinal() - EPOCH_ORDINAL) * 86400 + dt.hour * 3600 + dt.minute * 60 + dt.second
+
+
+def from_epoch(ts: int) -> datetime:
+    return datetime(1970, 1, 1) + timedelta(seconds=ts)
+
+
+def epoch_day_to_date(day: int) -> date:
+    return date.fromordinal(EPOCH_ORDINAL + day)
+
+
+class MessageStore:
+    """
+    Columnar container for a message history.
+
+    Timestamps are int64 epoch seconds, senders are interned into small
+    integer codes, and all message text lives in one utf-8 buffer indexed
+    by offsets. Iterating yields regular `Message` objects, so anything that
+    took a list of messages keeps working; the group-by helpers work on
+    the integer columns directly.
+    """
+
+    def __init__(self):
+        self.timestamps = array('q')
+        self.sender_codes = array('H')
+        self.senders = []
+        self.sender_index = {}
+        self.text = bytearray()
+        self.offsets = array('Q', [0])
+        # the newest timestamp string as loaded, sub-second part included;
+        # `timestamps` only keeps whole seconds
+        self.latest = None
+        self._columns = None
+
+    def append(self, sender: str, message: str, timestamp: datetime):
+        self.append_epoch(sender, message, to_epoch(timestamp))
+
+    def see_timestamp(self, ts: str):
+        if self.latest is None or ts > self.latest:
+            self.latest = ts
+
+    def append_epoch(self, sender: str, message: str, ts: int):
+        code = self.sender_index.get(sender)
+        if code is None:
+            code = len(self.senders)
+            self.senders.append(sender)
+            self.sender_index[sender] = code
+        self.timestamps.append(ts)
+        self.sender_codes.append(code)
+        self.text += message.encode()
+        self.offsets.append(len(self.text))
+        self._columns = None
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def message_text(self, i: int) -> str:
+        return self.text[self.offsets[i]:self.offsets[i + 1]].decode()
+
+    def __getitem__(self, i: int) -> Message:
+        if i < 0:
+            i += len(self)
+        return Message(
+            self.senders[self.sender_codes[i]],
+            self.message_text(i),
+            from_epoch(self.timestamps[i]),
+        )
+
+    def __iter__(self):
+        senders = self.senders
+        text = self.text
+        offsets = self.offsets
+        for i, (ts, code) in enumerate(zip(self.timestamps, self.sender_codes)):
+            yield Message(
+                senders[code],
+                text[offsets[i]:offsets[i + 1]].decode(),
+                from_epoch(ts),
+            )
+
+    def texts(self):
+        text = self.text
+        offsets = self.offsets
+        for i in range(len(self)):
+            yield text[offsets[i]:offsets[i + 1]].decode()
+
+    # Group-bys over the integer columns. Counters keep first-appearance
+    # order, same as the per-message loops in analytics.py. With NumPy
+    # installed they run vectorized, see vectorized.py.
+
+    def columns(self):
+        if self._columns is None:
+            self._columns = vectorized.TimeColumns(self)
+        return self._columns
+
+    def days(self):
+        return (ts // 86400 for ts in self.timestamps)
+
+    def distinct_days(self):
+        """Sorted epoch days that have at least one message."""
+        if vectorized.available():
+            return vectorized.distinct_days(self.columns())
+        return sorted(set(self.days()))
+
+    def hour_counts(self) -> Counter:
+        if vectorized.available():
+            return vectorized.hour_counts(self.columns())
+        return Counter(ts // 3600 % 24 for ts in self.timestamps)
+
+    def sender_counts(self) -> Counter:
+        counts = Counter()
+        for code, count in Counter(self.sender_codes).items():
+            counts[self.senders[code]] += count
+        return counts
+
+    def day_sender_counts(self) -> Counter:
+        """Counter keyed by (epoch day, sender code)."""
+        if vectorized.available():
+            return vectorized.day_sender_counts(self.columns())
+        return Counter(zip(self.days(), self.sender_codes))
+
+    def month_starts(self):
+        """datetime of the first of the month, per message."""
+        if vectorized.available():
+            return vectorized.month_starts(self.columns())
+        starts = {}
+        months = []
+        for day in self.days():
+            month = starts.get(day)
+            if month is None:
+                d = epoch_day_to_date(day)
+                month = starts[day] = datetime(d.year, d.month, 1)
+            months.append(month)
+        return months
+
+
+MERGED_PATH = '../output/merged.jsonl'
+
+
+def iter_lines(path, chunk_size=1 << 20):
+    """Yield the lines of a file as bytes, reading it in large binary chunks."""
+    with open(path, 'rb') as f:
+        rest = b''
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            lines = (rest + chunk).split(b'\n')
+            rest = lines.pop()
+            yield from lines
+        if rest:
+            yield rest
+
+
+def records_from_lines(lines, since: Optional[str] = None):
+    # `since` is a timestamp string; only strictly newer messages are kept.
+    # The timestamp format sorts lexicographically (a whole second sorts
+    # before the same second with microseconds), so older records are
+    # dropped before their timestamp is parsed. Every `since` filter
+    # compares this way, against the exact string the checkpoint saved.
+    for line in lines:
+        if not line.strip():
+            continue
+        data = json_loads(line)
+        if since is not None and data['timestamp'] <= since:
+            continue
+        yield data
+
+
+def messages_from_lines(lines, since: Optional[str] = None):
+    for data in records_from_lines(lines, since):
+        yield Message.from_dict(data)
+
+
+def iter_messages_from_merged(since: Optional[str] = None):
+    """Stream merged.jsonl one Message at a time; memory stays flat."""
+    return messages_from_lines(iter_lines(MERGED_PATH), since)
+
+
+def store_from_lines(lines, since: Optional[str] = None) -> MessageStore:
+    store = MessageStore()
+    for data in records_from_lines(lines, since):
+        store.append_epoch(data['sender'], data['message'], timestamp_to_epoch(data['timestamp']))
+        store.see_timestamp(data['timestamp'])
+    return store
+
+
+def load_messages_from_merged(since: Optional[str] = None) -> MessageStore:
+    # the binary archive merge.py writes alongside is a lot cheaper to load
+    # than parsing JSON; archive.py imports this module, hence the late import
+    from archive import open_archive
+    archive = open_archive()
+    if archive is not None:
+        try:
+            return archive.store(since)
+        finally:
+            archive.close()
+    return store_from_lines(iter_lines(MERGED_PATH), since)
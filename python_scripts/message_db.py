@@ -0,0 +1,173 @@
+import os
+import sqlite3
+import sys
+
+import fingerprint
+from message import MERGED_PATH, MessageStore, iter_lines, records_from_lines, timestamp_to_epoch
+
+# Optional local copy of merged.jsonl in SQLite, for tools that only need a
+# slice of the history:
+#   * `messages` keeps the records in merged.jsonl order (rowid), with a
+#     B-tree index on timestamp and one on (sender, timestamp)
+#   * `messages_fts` is an FTS5 index over the message text. The trigram
+#     tokenizer makes it work for substring lookups (`contains`) as well as
+#     word queries (`search`), and it handles emoji and text without spaces.
+#   * `meta` holds the fingerprint digest (fingerprint.py) of the
+#     merged.jsonl it was built from
+#
+# `merge.py --db` builds it together with merged.jsonl, or run
+# `message_db.py build` afterwards. Readers only use it while merged.jsonl
+# still matches that digest (see `fresh`), otherwise they scan the file.
+
+DB_PATH = '../output/messages.sqlite'
+
+COLUMNS = 'id, message, sender, timestamp'
+
+
+def fresh(path=DB_PATH, merged_path=MERGED_PATH) -> bool:
+    if not os.path.exists(path):
+        return False
+    if not os.path.exists(merged_path):
+        return True
+    try:
+        conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+        try:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'jsonl_digest'").fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        # built before the digest was stored
+        return False
+    return row is not None and fingerprint.matches(merged_path, row[0])
+
+
+def build(records, jsonl_digest: str, path=DB_PATH) -> int:
+    """
+    Write `records` (time-ordered dicts) to a new database and swap it in.
+
+    It's built in a side file with indexes created after the bulk insert,
+    so readers never see a half-written store.
+    """
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    conn.execute('PRAGMA journal_mode=OFF')
+    conn.execute('PRAGMA synchronous=OFF')
+    conn.executescript('''
+        CREATE TABLE messages (
+            rowid INTEGER PRIMARY KEY,
+            id TEXT NOT NULL,
+            message TEXT NOT NULL,
+            sender TEXT NOT NULL,
+            timestamp TEXT NOT NULL
+        );
+        CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+    ''')
+    conn.execute("INSERT INTO meta (key, value) VALUES ('jsonl_digest', ?)", (jsonl_digest,))
+    cursor = conn.executemany(
+        'INSERT INTO messages (id, message, sender, timestamp) VALUES (?, ?, ?, ?)',
+        ((r['id'], r['message'], r['sender'], r['timestamp']) for r in records),
+    )
+    count = cursor.rowcount
+    conn.executescript('''
+        CREATE INDEX messages_timestamp ON messages (timestamp);
+        CREATE INDEX messages_sender ON messages (sender, timestamp);
+        CREATE INDEX messages_id ON messages (id);
+        CREATE VIRTUAL TABLE messages_fts USING fts5(
+            message, content='messages', content_rowid='rowid', tokenize='trigram'
+        );
+        INSERT INTO messages_fts (rowid, message) SELECT rowid, message FROM messages;
+        INSERT INTO messages_fts (messages_fts) VALUES ('optimize');
+    ''')
+    conn.commit()
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.close()
+
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    os.replace(tmp_path, path)
+    return count
+
+
+def build_from_merged(path=DB_PATH, merged_path=MERGED_PATH) -> int:
+    return build(records_from_lines(iter_lines(merged_path)), fingerprint.digest(merged_path), path)
+
+
+class MessageDB:
+    def __init__(self, path=DB_PATH):
+        self.conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+        self.conn.row_factory = sqlite3.Row
+
+    def _records(self, sql, params=()):
+        return (dict(row) for row in self.conn.execute(sql, params))
+
+    def count(self) -> int:
+        return self.conn.execute('SELECT count(*) FROM messages').fetchone()[0]
+
+    def between(self, start: str, end: str, sender=None):
+        """Messages with start <= timestamp < end, in time order."""
+        if sender is None:
+            return self._records(
+                f'SELECT {COLUMNS} FROM messages WHERE timestamp >= ? AND timestamp < ? ORDER BY timestamp, rowid',
+                (start, end),
+            )
+        return self._records(
+            f'SELECT {COLUMNS} FROM messages WHERE sender = ? AND timestamp >= ? AND timestamp < ? '
+            'ORDER BY timestamp, rowid',
+            (sender, start, end),
+        )
+
+    def since(self, since=None):
+        """Every message newer than `since` (or all of them), in merged.jsonl order."""
+        if since is None:
+            return self._records(f'SELECT {COLUMNS} FROM messages ORDER BY rowid')
+        return self._records(
+            f'SELECT {COLUMNS} FROM messages WHERE timestamp > ? ORDER BY rowid', (since,)
+        )
+
+    def search(self, query: str, limit=None):
+        """FTS5 query (words, "phrases", AND/OR/NOT) over message text, in time order."""
+        sql = (
+            f'SELECT {COLUMNS} FROM messages WHERE rowid IN '
+            '(SELECT rowid FROM messages_fts WHERE messages_fts MATCH ?) ORDER BY rowid'
+        )
+        if limit is not None:
+            sql += f' LIMIT {int(limit)}'
+        return self._records(sql, (query,))
+
+    def contains(self, substring: str):
+        """Messages whose text contains `substring`, like `substring in message`."""
+        if len(substring) < 3:
+            # trigrams can't help with one or two characters
+            return (
+                r for r in self._records(f'SELECT {COLUMNS} FROM messages ORDER BY rowid')
+                if substring in r['message']
+            )
+        phrase = '"' + substring.replace('"', '""') + '"'
+        # the trigram match is case-insensitive, the exact check isn't
+        return (r for r in self.search(phrase) if substring in r['message'])
+
+    def store(self, since=None) -> MessageStore:
+        store = MessageStore()
+        for record in self.since(since):
+            store.append_epoch(record['sender'], record['message'], timestamp_to_epoch(record['timestamp']))
+            store.see_timestamp(record['timestamp'])
+        return store
+
+    def close(self):
+        self.conn.close()
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'build'
+    if command == 'build':
+        print(f'Wrote {build_from_merged()} messages to {DB_PATH}')
+    elif command == 'search':
+        db = MessageDB()
+        for record in db.search(' '.join(sys.argv[2:])):
+            print(f"[{record['timestamp']}] {record['sender']}: {record['message']}")
+        db.close()
+    else:
+        print('usage: message_db.py [build | search QUERY]')
@@ -0,0 +1,18 @@
+import pytest
+
+from message import Message, parse_timestamp, timestamp_to_epoch, to_epoch
+from metrics import HighWaterMark
+
+
+@pytest.mark.parametrize('ts', ['2023-05-01 10:11:12', '2023-05-01 10:11:12.250000', '2023-12-31 23:59:59.999999'])
+def test_parse_timestamp_round_trips(ts):
+    dt = parse_timestamp(ts)
+    assert str(dt) == ts
+    assert to_epoch(dt) == timestamp_to_epoch(ts)
+
+
+def test_high_water_mark_keeps_microseconds():
+    mark = HighWaterMark()
+    for ts in ['2023-05-01 10:11:12.250000', '2023-05-01 10:11:12', '2023-05-01 10:11:12.750000']:
+        mark.update(Message.from_dict({'sender': 'Nadia', 'message': 'hi', 'timestamp': ts}))
+    assert mark.finalize() == '2023-05-01 10:11:12.750000'
@@ -1,8 +1,11 @@
 from message import Message
 from imessage_old import get_senders
+from extsort import SpillingSorter
+from json_stream import JsonStream, ijson, use_ijson
 
 import json
 import datetime
+from operator import attrgetter
 
 
 def unix_to_local_timestamp(unix_ts):
@@ -12,10 +15,16 @@ def unix_to_local_timestamp(unix_ts):
 
 
 def parse_messenger_json(messenger_dict):
+    return parse_messenger_messages(messenger_dict["messages"])
+
+
+def parse_messenger_messages(message_dicts):
+    """The messages in time order, as an iterator over the sorter (no second list)."""
     senders = get_senders()
 
-    messages = []
-    for message_dict in messenger_dict["messages"]:
+    # sorted with a bound on memory, spilling to disk past it
+    messages = SpillingSorter(key=attrgetter('timestamp'))
+    for message_dict in message_dicts:
         content = ''
         # We're only parsing text & links
         if message_dict['type'] in ('placeholder', 'media'):
@@ -30,20 +39,48 @@ def parse_messenger_json(messenger_dict):
         # This is pretty arbitrary
         message_id = 'messenger-' + str(message_dict["timestamp"])
         timestamp = unix_to_local_timestamp(message_dict["timestamp"])
-        messages.append(Message(
+        messages.add(Message(
             sender,
             content,
             timestamp,
             message_id,
         ))
 
-    messages.sort(key=lambda m: m.timestamp)
-    return messages
+    return iter(messages)
+
+
+def iter_messenger_file(path):
+    """The export's message dicts, streamed instead of loading the whole file."""
+    if use_ijson():
+        with open(path, 'rb') as f:
+            yield from ijson.items(f, 'messages.item', use_float=True)
+        return
+    with open(path, 'r') as f:
+        stream = JsonStream(f)
+        for key in stream.iter_object():
+            if key != 'messages':
+                stream.skip_value()
+                continue
+            for _ in stream.iter_array():
+                yield stream.read_value()
+
+
+def parse_messenger_file(path):
+    return parse_messenger_messages(iter_messenger_file(path))
 
 
 def write_to_json(messages):
+    """Write the messages one at a time, as json.dumps of the list would; returns the count."""
+    count = 0
     with open(f'../output/messenger.json', 'w') as json_file:
-        json_file.write(json.dumps([m.to_dict() for m in messages]))
+        json_file.write('[')
+        for m in messages:
+            if count:
+                json_file.write(', ')
+            json_file.write(json.dumps(m.to_dict()))
+            count += 1
+        json_file.write(']')
+    return count
 
 
 def print_types(messenger_dict):
@@ -53,8 +90,5 @@ def print_types(messenger_dict):
     print(types)
 
 if __name__ == '__main__':
-    with open('../data_sources/messenger.json', 'r') as messenger_json_file:
-        messenger_dict = json.loads(messenger_json_file.read())
-
-    messages = parse_messenger_json(messenger_dict)
+    messages = parse_messenger_file('../data_sources/messenger.json')
     write_to_json(messages)
@@ -0,0 +1,630 @@
+import abc
+import collections
+import json
+import re
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+from message import MessageStore, epoch_day_to_date, from_epoch, store_from_lines, to_epoch
+from response_times import DEFAULT_CUTOFF, DEFAULT_SENDERS, ResponseTimeEngine
+from rollups import TopK
+from tokens import features
+
+# Accumulator engine behind `analytics.py all`. Every metric registers an
+# update/finalize pair and `run_metrics` feeds all of them in a single pass
+# over the messages, instead of each analytics function rescanning the list.
+#
+# Metrics can also dump their state to a JSON checkpoint (`state` and
+# `load_state`) so `analytics.py all --incremental` only has to fold in
+# messages newer than the last run.
+#
+# For `--workers N`, shards of merged.jsonl are run in separate processes and
+# the partial metrics are combined with `merge`, always in file order, so the
+# result (including Counter tie order) is identical to a serial run.
+#
+# Metrics that only need timestamps and senders may implement
+# `update_store`, which gets a whole `MessageStore` and works on its integer
+# columns instead of being called once per message.
+
+METRICS = {}
+
+
+def register(name):
+    def wrap(cls):
+        if cls.__abstractmethods__:
+            missing = ', '.join(sorted(cls.__abstractmethods__))
+            raise TypeError(f"metric {name!r} ({cls.__name__}) doesn't implement {missing}")
+        cls.name = name
+        METRICS[name] = cls
+        return cls
+    return wrap
+
+
+class Metric(abc.ABC):
+    name = None
+
+    @abc.abstractmethod
+    def update(self, msg):
+        ...
+
+    @abc.abstractmethod
+    def finalize(self):
+        ...
+
+    @abc.abstractmethod
+    def state(self):
+        ...
+
+    @abc.abstractmethod
+    def load_state(self, state):
+        ...
+
+    @abc.abstractmethod
+    def merge(self, other):
+        """Fold in `other`, which saw the messages right after ours."""
+
+
+@register("num_words_total")
+class WordCount(Metric):
+    def __init__(self):
+        self.total = 0
+
+    def update(self, msg):
+        text = features(msg.message)
+        if not text.skipped:
+            self.total += text.word_count
+
+    def update_store(self, store):
+        for text in map(features, store.texts()):
+            if not text.skipped:
+                self.total += text.word_count
+
+    def finalize(self):
+        return self.total
+
+    def state(self):
+        return self.total
+
+    def load_state(self, state):
+        self.total = state
+
+    def merge(self, other):
+        self.total += other.total
+
+
+@register("num_messages")
+class MessageCounts(Metric):
+    def __init__(self):
+        self.total = 0
+        self.nadia = 0
+        self.stephen = 0
+
+    def update(self, msg):
+        self.total += 1
+        sender = msg.sender.lower()
+        if sender == "nadia":
+            self.nadia += 1
+        elif sender == "stephen":
+            self.stephen += 1
+
+    def update_store(self, store):
+        self.total += len(store)
+        for sender, count in store.sender_counts().items():
+            sender = sender.lower()
+            if sender == "nadia":
+                self.nadia += count
+            elif sender == "stephen":
+                self.stephen += count
+
+    def finalize(self):
+        return self.total, self.nadia, self.stephen
+
+    def state(self):
+        return [self.total, self.nadia, self.stephen]
+
+    def load_state(self, state):
+        self.total, self.nadia, self.stephen = state
+
+    def merge(self, other):
+        self.total += other.total
+        self.nadia += other.nadia
+        self.stephen += other.stephen
+
+
+@register("num_days")
+class DistinctDays(Metric):
+    def __init__(self):
+        self.days = set()
+
+    def update(self, msg):
+        self.days.add(msg.timestamp.date())
+
+    def update_store(self, store):
+        self.days.update(map(epoch_day_to_date, store.distinct_days()))
+
+    def finalize(self):
+        return len(self.days)
+
+    def state(self):
+        return sorted(str(day) for day in self.days)
+
+    def load_state(self, state):
+        self.days = {date.fromisoformat(day) for day in state}
+
+    def merge(self, other):
+        self.days |= other.days
+
+
+@register("emoji_frequency")
+class EmojiFrequency(Metric):
+    def __init__(self, top_n=100):
+        self.top_n = top_n
+        self.counter = collections.Counter()
+
+    def update(self, msg):
+        self.counter.update(features(msg.message).emojis)
+
+    def update_store(self, store):
+        counter = self.counter
+        for text in map(features, store.texts()):
+            if text.emojis:
+                counter.update(text.emojis)
+
+    def finalize(self):
+        return self.counter.most_common(self.top_n)
+
+    def state(self):
+        return dict(self.counter)
+
+    def load_state(self, state):
+        self.counter = collections.Counter(state)
+
+    def merge(self, other):
+        self.counter.update(other.counter)
+
+
+@register("word_frequency")
+class WordFrequency(Metric):
+    def __init__(self, top_n=100):
+        self.top_n = top_n
+        self.counter = collections.Counter()
+
+    def update(self, msg):
+        text = features(msg.message)
+        if not text.skipped:
+            self.counter.update(text.words)
+
+    def update_store(self, store):
+        counter = self.counter
+        for text in map(features, store.texts()):
+            if not text.skipped:
+                counter.update(text.words)
+
+    def finalize(self):
+        return self.counter.most_common(self.top_n)
+
+    def state(self):
+        return dict(self.counter)
+
+    def load_state(self, state):
+        self.counter = collections.Counter(state)
+
+    def merge(self, other):
+        self.counter.update(other.counter)
+
+
+@register("message_frequency_per_day_per_person")
+class DayPersonFrequency(Metric):
+    def __init__(self):
+        self.freq = collections.defaultdict(collections.Counter)
+
+    def update(self, msg):
+        self.freq[msg.timestamp.date()][msg.sender.lower()] += 1
+
+    def update_store(self, store):
+        senders = [sender.lower() for sender in store.senders]
+        for (day, code), count in store.day_sender_counts().items():
+            self.freq[epoch_day_to_date(day)][senders[code]] += count
+
+    def finalize(self):
+        return self.freq
+
+    def state(self):
+        return {str(day): dict(counts) for day, counts in self.freq.items()}
+
+    def load_state(self, state):
+        self.freq = collections.defaultdict(collections.Counter)
+        for day, counts in state.items():
+            self.freq[date.fromisoformat(day)] = collections.Counter(counts)
+
+    def merge(self, other):
+        for day, counts in other.freq.items():
+            self.freq[day].update(counts)
+
+
+@register("day_tokens")
+class DayTokens(Metric):
+    """Top words and emojis per day, for the rollups (see rollups.py)."""
+
+    def __init__(self):
+        self.days = {}
+
+    def _day(self, day):
+        tokens = self.days.get(day)
+        if tokens is None:
+            tokens = self.days[day] = (TopK(), TopK())
+        return tokens
+
+    def update(self, msg):
+        text = features(msg.message)
+        words, emojis = self._day(msg.timestamp.date())
+        if not text.skipped:
+            words.update(text.words)
+        emojis.update(text.emojis)
+
+    def update_store(self, store):
+        current = None
+        for text, day in zip(map(features, store.texts()), store.days()):
+            if day != current:
+                current = day
+                words, emojis = self._day(epoch_day_to_date(day))
+            if not text.skipped and text.words:
+                words.update(text.words)
+            if text.emojis:
+                emojis.update(text.emojis)
+
+    def finalize(self):
+        return self.days
+
+    def state(self):
+        return {str(day): [words.state(), emojis.state()] for day, (words, emojis) in self.days.items()}
+
+    def load_state(self, state):
+        self.days = {
+            date.fromisoformat(day): (TopK.from_state(words), TopK.from_state(emojis))
+            for day, (words, emojis) in state.items()
+        }
+
+    def merge(self, other):
+        for day, (words, emojis) in other.days.items():
+            mine = self._day(day)
+            mine[0].merge(words)
+            mine[1].merge(emojis)
+
+
+@register("message_count_by_hour")
+class HourCounts(Metric):
+    def __init__(self):
+        self.counter = collections.Counter()
+
+    def update(self, msg):
+        self.counter[msg.timestamp.hour] += 1
+
+    def update_store(self, store):
+        self.counter.update(store.hour_counts())
+
+    def finalize(self):
+        return self.counter
+
+    def state(self):
+        return {str(hour): count for hour, count in self.counter.items()}
+
+    def load_state(self, state):
+        self.counter = collections.Counter({int(hour): count for hour, count in state.items()})
+
+    def merge(self, other):
+        self.counter.update(other.counter)
+
+
+@register("response_times")
+class ResponseTimes(Metric):
+    """
+    Per-day, per-sender and overall response times, see response_times.py.
+
+    Response times depend on message order, so updates only collect
+    (timestamp, sender) pairs; the engine sorts them once when folding and
+    continues from the last folded message, which is what lets a
+    checkpoint pick up where the previous run stopped.
+    """
+
+    def __init__(self, senders=DEFAULT_SENDERS, cutoff=DEFAULT_CUTOFF):
+        self.engine = ResponseTimeEngine(senders, cutoff)
+
+    def update(self, msg):
+        self.engine.add(to_epoch(msg.timestamp), msg.sender)
+
+    def update_store(self, store):
+        self.engine.add_columns(store.timestamps, store.sender_codes, store.senders)
+
+    def finalize(self):
+        return self.engine.results()
+
+    def state(self):
+        return self.engine.state()
+
+    def load_state(self, state):
+        self.engine.load_state(state)
+
+    def merge(self, other):
+        self.engine.extend(other.engine)
+
+
+@register("bursting_word_series")
+class WordBursts(Metric):
+    def __init__(self):
+        self.global_start = None
+        self.word_month_counts = defaultdict(_int_dict)
+
+    def update(self, msg):
+        if self.global_start is None or msg.timestamp < self.global_start:
+            self.global_start = msg.timestamp
+        text = features(msg.message)
+        if text.skipped:
+            return
+        month_key = datetime(msg.timestamp.year, msg.timestamp.month, 1)
+        for word in text.words:
+            self.word_month_counts[word][month_key] += 1
+
+    def update_store(self, store):
+        if not len(store):
+            return
+        start = from_epoch(min(store.timestamps))
+        if self.global_start is None or start < self.global_start:
+            self.global_start = start
+        word_month_counts = self.word_month_counts
+        for text, month_key in zip(store.texts(), store.month_starts()):
+            text = features(text)
+            if text.skipped:
+                continue
+            for word in text.words:
+                word_month_counts[word][month_key] += 1
+
+    def finalize(self):
+        if self.global_start is None:
+            return {}
+        return find_bursting_words(self.word_month_counts, self.global_start)
+
+    def state(self):
+        return {
+            "global_start": str(self.global_start) if self.global_start else None,
+            "word_month_counts": {
+                word: {m.strftime("%Y-%m"): count for m, count in month_counts.items()}
+                for word, month_counts in self.word_month_counts.items()
+            },
+        }
+
+    def load_state(self, state):
+        global_start = state["global_start"]
+        self.global_start = datetime.fromisoformat(global_start) if global_start else None
+        self.word_month_counts = defaultdict(_int_dict)
+        for word, month_counts in state["word_month_counts"].items():
+            for m, count in month_counts.items():
+                self.word_month_counts[word][datetime.strptime(m, "%Y-%m")] = count
+
+    def merge(self, other):
+        if other.global_start is not None:
+            if self.global_start is None or other.global_start < self.global_start:
+                self.global_start = other.global_start
+        for word, month_counts in other.word_month_counts.items():
+            counts = self.word_month_counts[word]
+            for m, count in month_counts.items():
+                counts[m] += count
+
+
+@register("high_water_mark")
+class HighWaterMark(Metric):
+    """
+    Timestamp of the newest message seen, used as the incremental cutoff.
+
+    Kept as the exact timestamp string, microseconds included, since that's
+    what the `since` filters compare against; a cutoff rounded down to the
+    second would count messages later in that second twice.
+    """
+
+    def __init__(self):
+        self.latest = None
+
+    def update(self, msg):
+        self.merge_latest(str(msg.timestamp))
+
+    def update_store(self, store):
+        if store.latest is not None:
+            self.merge_latest(store.latest)
+        elif store.timestamps:
+            self.merge_latest(str(from_epoch(max(store.timestamps))))
+
+    def merge_latest(self, latest):
+        if self.latest is None or latest > self.latest:
+            self.latest = latest
+
+    def finalize(self):
+        return self.latest
+
+    def state(self):
+        return self.latest
+
+    def load_state(self, state):
+        self.latest = state
+
+    def merge(self, other):
+        if other.latest is not None:
+            self.merge_latest(other.latest)
+
+
+def _int_dict():
+    # module level (not a lambda) so metrics can be pickled back from workers
+    return defaultdict(int)
+
+
+def normalize_word(word):
+    # For example, 'mrrr' becomes 'mr' – note this simple method will collapse all runs.
+    return re.sub(r'(.)\1+', r'\1', word)
+
+
+def find_bursting_words(word_month_counts, global_start):
+    """
+    Burst detection on per-word monthly counts, see `detect_new_word_bursts`
+    in analytics.py for the rules.
+    """
+    boundary_date = global_start + timedelta(days=60)
+
+    # Detect bursting words in the original dictionary.
+    bursting_words = {}
+    for word, month_counts in word_month_counts.items():
+        total_usage = sum(month_counts.values())
+        if total_usage <= 25:
+            continue
+        months_sorted = sorted(month_counts.keys())
+        if not months_sorted:
+            continue
+        # Consider only words that did NOT appear until after the first two months.
+        first_month = months_sorted[0]
+        if first_month < boundary_date:
+            continue
+        base_count = month_counts[first_month]
+        burst_found = False
+        for m in months_sorted[1:]:
+            if month_counts[m] >= 5 * base_count:
+                burst_found = True
+                break
+        if burst_found:
+            bursting_words[word] = month_counts
+
+    # Now, group similar bursting words using normalization.
+    # For each original bursting word, compute its normalized form.
+    # Then merge counts for words with the same normalized outcome.
+    grouped_bursts = {}  # key: normalized word, value: tuple(set(original_words), merged_counts dict)
+    for word, month_counts in bursting_words.items():
+        norm = normalize_word(word)
+        if norm not in grouped_bursts:
+            # Create a copy of month_counts so later merging will work fine.
+            grouped_bursts[norm] = (set([word]), dict(month_counts))
+        else:
+            orig_set, merged = grouped_bursts[norm]
+            orig_set.add(word)
+            for m, count in month_counts.items():
+                merged[m] = merged.get(m, 0) + count
+
+    # For each group, if more than one word was merged or the original word doesn't equal the normalized version,
+    # add an asterisk to indicate merging.
+    final_bursts = {}
+    for norm, (orig_set, merged_counts) in grouped_bursts.items():
+        if len(orig_set) > 1 or any(word != norm for word in orig_set):
+            label = norm + "*"
+        else:
+            label = norm
+        final_bursts[label] = merged_counts
+    return final_bursts
+
+
+def run_metrics(messages, metrics=None):
+    """Feed every message to every metric once and return {name: result}."""
+    if metrics is None:
+        metrics = [cls() for cls in METRICS.values()]
+    feed(messages, metrics)
+    return {metric.name: metric.finalize() for metric in metrics}
+
+
+def feed(messages, metrics):
+    if isinstance(messages, MessageStore):
+        # column-capable metrics take the whole store at once
+        for metric in metrics:
+            if hasattr(metric, "update_store"):
+                metric.update_store(messages)
+        metrics = [metric for metric in metrics if not hasattr(metric, "update_store")]
+        if not metrics:
+            return
+    updates = [metric.update for metric in metrics]
+    for msg in messages:
+        for update in updates:
+            update(msg)
+
+
+def shard_ranges(path, num_shards):
+    """Split a file into `num_shards` byte ranges; lines belong to the shard they start in."""
+    size = Path(path).stat().st_size
+    step = max(1, -(-size // num_shards))
+    return [(start, min(start + step, size)) for start in range(0, size, step)]
+
+
+def run_shard(path, start, end, since=None):
+    metrics = [cls() for cls in METRICS.values()]
+    with open(path, "rb") as f:
+        if start:
+            # skip the tail of the line that started in the previous shard
+            f.seek(start - 1)
+            f.readline()
+        pos = f.tell()
+        lines = []
+        while pos < end:
+            line = f.readline()
+            if not line:
+                break
+            pos += len(line)
+            lines.append(line)
+    feed(store_from_lines(lines, since), metrics)
+    return metrics
+
+
+def run_metrics_sharded(path, workers, metrics=None, since=None):
+    """
+    Same as `run_metrics` over the messages in a merged.jsonl file, but the
+    per-message work runs in `workers` processes. `metrics` may hold
+    restored checkpoint state; shard results are merged into it in file order.
+    """
+    if metrics is None:
+        metrics = [cls() for cls in METRICS.values()]
+    # a few shards per worker keeps the pool busy when shards are uneven
+    ranges = shard_ranges(path, workers * 4)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        partials = executor.map(
+            run_shard,
+            [path] * len(ranges),
+            [start for start, _ in ranges],
+            [end for _, end in ranges],
+            [since] * len(ranges),
+        )
+        for partial in partials:
+            for metric, part in zip(metrics, partial):
+                metric.merge(part)
+    return {metric.name: metric.finalize() for metric in metrics}
+
+
+CHECKPOINT_VERSION = 2
+
+
+def save_checkpoint(path, metrics):
+    checkpoint = {
+        "version": CHECKPOINT_VERSION,
+        "metrics": {metric.name: metric.state() for metric in metrics},
+    }
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with tmp_path.open("w", encoding="utf-8") as f:
+        json.dump(checkpoint, f, ensure_ascii=False)
+    # replace atomically so a crashed run never leaves half a checkpoint
+    tmp_path.replace(path)
+
+
+def load_checkpoint(path, metrics):
+    """
+    Restore metric state from a checkpoint written by `save_checkpoint`.
+
+    Returns the high-water-mark timestamp string, or None when there is no
+    usable checkpoint (in which case the metrics are left untouched).
+    """
+    path = Path(path)
+    if not path.exists():
+        return None
+    with path.open("r", encoding="utf-8") as f:
+        checkpoint = json.load(f)
+    states = checkpoint.get("metrics", {})
+    if checkpoint.get("version") != CHECKPOINT_VERSION or any(m.name not in states for m in metrics):
+        print(f"Ignoring incompatible checkpoint {path}")
+        return None
+    for metric in metrics:
+        metric.load_state(states[metric.name])
+    return states["high_water_mark"]
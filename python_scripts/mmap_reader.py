@@ -0,0 +1,171 @@
+import json
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_left, bisect_right
+
+import fingerprint
+import time_index
+from message import MERGED_PATH, MessageStore, json_loads, timestamp_to_epoch
+
+# Zero-copy access to merged.jsonl for tools that only need a few messages.
+#
+# The file is memory-mapped and never read into Python strings as a whole.
+# Line offsets come from the time index merge.py writes (time_index.py), or
+# are scanned once and cached in merged.lines. `MergedFile[i]` is a
+# `RecordView` that only slices and decodes its line when a field is read.
+#
+# Sender and substring filters search the raw bytes first: merged.jsonl is
+# written by json.dumps, so a needle encoded the same way can be found with
+# mmap.find across the whole file, and only the lines it hits get decoded
+# to confirm the match.
+
+LINES_PATH = '../output/merged.lines'
+LINES_HEADER = struct.Struct('<8s32sq')
+LINES_MAGIC = b'NMDBLNS2'
+
+
+def scan_offsets(mm):
+    offsets = array('q', [0])
+    pos = mm.find(b'\n')
+    while pos != -1:
+        offsets.append(pos + 1)
+        pos = mm.find(b'\n', pos + 1)
+    if offsets[-1] != len(mm):
+        # no trailing newline
+        offsets.append(len(mm))
+    return offsets
+
+
+def load_line_offsets(mm, path, cache_path):
+    """
+    Offsets of every line in `mm`, plus the file size, cached in `cache_path`
+    under the file's fingerprint digest (fingerprint.py).
+    """
+    jsonl_digest = fingerprint.digest(path)
+    if os.path.exists(cache_path):
+        with open(cache_path, 'rb') as f:
+            header = f.read(LINES_HEADER.size)
+            if len(header) == LINES_HEADER.size:
+                magic, cached_digest, count = LINES_HEADER.unpack(header)
+                if magic == LINES_MAGIC and cached_digest.decode() == jsonl_digest:
+                    offsets = array('q')
+                    offsets.fromfile(f, count)
+                    return offsets
+    offsets = scan_offsets(mm)
+    tmp_path = cache_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(LINES_HEADER.pack(LINES_MAGIC, jsonl_digest.encode(), len(offsets)))
+        offsets.tofile(f)
+    os.replace(tmp_path, cache_path)
+    return offsets
+
+
+class RecordView:
+    """One line of merged.jsonl; the JSON is only decoded on first field access."""
+
+    __slots__ = ('mm', 'start', 'end', '_record')
+
+    def __init__(self, mm, start, end):
+        self.mm = mm
+        self.start = start
+        self.end = end
+        self._record = None
+
+    @property
+    def raw(self) -> bytes:
+        return self.mm[self.start:self.end]
+
+    @property
+    def record(self) -> dict:
+        if self._record is None:
+            self._record = json_loads(self.mm[self.start:self.end])
+        return self._record
+
+    def __getitem__(self, key):
+        return self.record[key]
+
+    def __repr__(self):
+        return f"{self['timestamp']} {self['sender']}: {self['message']}"
+
+
+class MergedFile:
+    def __init__(self, path=MERGED_PATH, lines_path=LINES_PATH):
+        self.path = path
+        with open(path, 'rb') as f:
+            # mmap can't map an empty file
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b''
+        self.index = time_index.open_index(merged_path=path) if path == MERGED_PATH else None
+        if self.index is not None:
+            self.offsets = self.index.offsets
+        else:
+            self.offsets = load_line_offsets(self.mm, path, lines_path) if self.mm else array('q', [0])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i) -> RecordView:
+        if i < 0:
+            i += len(self)
+        return RecordView(self.mm, self.offsets[i], self.offsets[i + 1])
+
+    def __iter__(self):
+        return self.views()
+
+    def views(self, start=0, end=None):
+        """Views of lines [start, end), skipping blank ones."""
+        end = len(self) if end is None else end
+        return (self[i] for i in range(start, end) if self.offsets[i + 1] - self.offsets[i] > 1)
+
+    def line_of(self, pos) -> int:
+        return bisect_right(self.offsets, pos) - 1
+
+    def find_raw(self, needle: bytes):
+        """Views of the lines whose raw bytes contain `needle`, each once."""
+        pos = self.mm.find(needle)
+        while pos != -1:
+            i = self.line_of(pos)
+            yield self[i]
+            # carry on from the next line
+            pos = self.mm.find(needle, self.offsets[i + 1])
+
+    def grep(self, substring: str):
+        """Views whose message contains `substring`."""
+        needle = json.dumps(substring)[1:-1].encode()
+        return (view for view in self.find_raw(needle) if substring in view['message'])
+
+    def by_sender(self, sender: str):
+        needle = b'"sender": ' + json.dumps(sender).encode()
+        return (view for view in self.find_raw(needle) if view['sender'] == sender)
+
+    def first_after(self, since: str) -> int:
+        """Line number of the first message that could be newer than `since`."""
+        if self.index is None:
+            return 0
+        return bisect_left(self.index.epochs, timestamp_to_epoch(since))
+
+    def window(self, start: int, end: int):
+        """Views with start <= epoch seconds < end; bisects the time index if there is one."""
+        if self.index is None:
+            return (view for view in self.views() if start <= timestamp_to_epoch(view['timestamp']) < end)
+        first, last = self.index.span(start, end)
+        return self.views(first, last)
+
+    def store(self, since=None) -> MessageStore:
+        # with a time index, everything before `since` is skipped undecoded
+        store = MessageStore()
+        first = 0 if since is None else self.first_after(since)
+        for view in self.views(first):
+            record = view.record
+            if since is not None and record['timestamp'] <= since:
+                continue
+            store.append_epoch(record['sender'], record['message'], timestamp_to_epoch(record['timestamp']))
+            store.see_timestamp(record['timestamp'])
+        return store
+
+    def close(self):
+        if self.index is not None:
+            self.index.close()
+        if self.mm:
+            self.mm.close()
@@ -0,0 +1,199 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import imessage
+from archive import Archive, ArchiveWriter
+from fingerprint import BLOCK_SIZE, block_hash, fingerprint, read_block
+
+# Parsed sources, kept between ingest runs.
+#
+# Each export's parsed messages (the dicts ingest.py writes) are stored in
+# ../output/parse_cache/<source>.nmdb, in the archive format of archive.py,
+# in the order the parser produced them. Next to it, <source>.json holds
+# the fingerprint of the export they came from (fingerprint.py): size,
+# mtime, and a hash of its first and last 64KB. When the fingerprint still matches, the archive
+# is read back instead of parsing again.
+#
+# txt exports only ever grow at the end, so a txt entry also remembers a
+# resume point: the byte offset of the last message whose block was closed
+# by a later timestamp line, and how many messages came before it. If the
+# file got longer and still has the same head and the same bytes where it
+# used to end, only the part from the resume point on is parsed again.
+#
+# Only the head and tail are hashed, so an edit somewhere in the middle of
+# an export goes unnoticed unless it changes the size or mtime (and for
+# txt, not even then); `ingest.py --no-cache` parses everything again.
+# The sender mapping and the parser sources are part of the key too; a
+# change to either throws the cached messages away.
+
+CACHE_DIR = Path('../output/parse_cache')
+PARSER_SOURCES = ['imessage.py', 'imessage_json.py', 'messenger.py', 'message.py']
+VERSION = 1
+
+
+def parser_key(kind, senders_map) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f'{VERSION} {kind}'.encode())
+    h.update(json.dumps(senders_map, sort_keys=True).encode())
+    here = Path(__file__).parent
+    for name in PARSER_SOURCES:
+        h.update((here / name).read_bytes())
+    return h.hexdigest()
+
+
+def is_appended(path, old: dict, new: dict) -> bool:
+    """Whether `path` is the file `old` was taken of, with more bytes at the end."""
+    if new['size'] <= old['size']:
+        return False
+    with open(path, 'rb') as f:
+        # a file shorter than one block had all of itself as its head
+        if block_hash(f.read(min(BLOCK_SIZE, old['size']))) != old['head']:
+            return False
+        return block_hash(read_block(f, old['size'])) == old['tail']
+
+
+class _TrackedLines:
+    """Decoded lines of a binary file, remembering where the last one started."""
+
+    def __init__(self, f):
+        self.f = f
+        self.offset = f.tell()
+        self.line_start = None
+        self.done = False
+
+    def __iter__(self):
+        for raw in self.f:
+            self.line_start = self.offset
+            self.offset += len(raw)
+            line = raw.decode('utf-8')
+            # what text mode's newline translation would have given
+            if line.endswith('\r\n'):
+                line = line[:-2] + '\n'
+            yield line
+        self.done = True
+
+
+class TxtParse:
+    """
+    Message dicts of a txt export from byte offset `start` on. Once it's
+    been iterated, `resume` is the resume point: an offset, and how many of
+    the messages came before it.
+    """
+
+    def __init__(self, path, senders_map, start=0):
+        self.path = path
+        self.senders_map = senders_map
+        self.start = start
+        self.resume = (start, 0)
+
+    def __iter__(self):
+        count = 0
+        with open(self.path, 'rb') as f:
+            f.seek(self.start)
+            lines = _TrackedLines(f)
+            for message in imessage.iter_messages(lines, self.senders_map):
+                count += 1
+                if not lines.done:
+                    # this message was closed by the timestamp line just
+                    # read, which starts the next one
+                    self.resume = (lines.line_start, count)
+                yield message.to_dict()
+
+
+class CacheWriter:
+    """Builds a cache entry as records go by; gives up quietly if one can't be archived."""
+
+    def __init__(self, cache):
+        cache.meta_path.parent.mkdir(parents=True, exist_ok=True)
+        # the meta goes last, so a half-written entry is never trusted
+        if cache.meta_path.exists():
+            cache.meta_path.unlink()
+        self.cache = cache
+        self.writer = ArchiveWriter(cache.archive_path)
+
+    def add(self, record):
+        if self.writer is None:
+            return
+        try:
+            self.writer.add(record)
+        except ValueError as e:
+            # e.g. a timestamp the archive format can't hold
+            print(f'Not caching {self.cache.archive_path}: {e}')
+            self.writer.abort()
+            self.writer = None
+
+    def close(self, meta):
+        if self.writer is None:
+            return
+        self.writer.close()
+        tmp = Path(str(self.cache.meta_path) + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(dict(meta, count=self.writer.count), f)
+        tmp.replace(self.cache.meta_path)
+
+
+class ParseCache:
+    def __init__(self, name, cache_dir=CACHE_DIR):
+        cache_dir = Path(cache_dir)
+        self.archive_path = str(cache_dir / f'{name}.nmdb')
+        self.meta_path = cache_dir / f'{name}.json'
+
+    def load_meta(self):
+        if not (self.meta_path.exists() and os.path.exists(self.archive_path)):
+            return None
+        with open(self.meta_path) as f:
+            return json.load(f)
+
+    def open(self) -> Archive:
+        return Archive(self.archive_path)
+
+
+def cached_records(kind, path, senders_map, parse, name=None, cache_dir=CACHE_DIR):
+    """
+    The message dicts of one export, in parse order: from the cache if the
+    export hasn't changed, otherwise from `parse(kind, path, senders_map)`
+    (or, for a txt export that only grew, the cache plus its new tail).
+    The cache entry is rewritten as they're consumed.
+    """
+    path = Path(path)
+    cache = ParseCache(name or path.name, cache_dir)
+    new = fingerprint(path)
+    key = parser_key(kind, senders_map)
+    meta = cache.load_meta()
+    if meta is not None and meta['key'] == key and meta['fingerprint'] == new:
+        archive = cache.open()
+        try:
+            yield from archive.records()
+        finally:
+            archive.close()
+        return
+
+    old = None
+    if meta is not None and meta['key'] == key and kind == 'imessage-txt':
+        if is_appended(path, meta['fingerprint'], new):
+            old = cache.open()
+    writer = CacheWriter(cache)
+    if old is not None:
+        offset, kept = meta['resume']
+        for record in old.records(0, kept):
+            writer.add(record)
+            yield record
+        # the writer replaces the file the old archive maps
+        old.close()
+        source = TxtParse(path, senders_map, offset)
+    elif kind == 'imessage-txt':
+        kept = 0
+        source = TxtParse(path, senders_map)
+    else:
+        source = (m.to_dict() for m in parse(kind, path, senders_map))
+
+    for record in source:
+        writer.add(record)
+        yield record
+    resume = None
+    if isinstance(source, TxtParse):
+        offset, closed = source.resume
+        resume = (offset, kept + closed)
+    writer.close({'key': key, 'fingerprint': new, 'resume': resume})
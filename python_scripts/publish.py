@@ -0,0 +1,124 @@
+import hashlib
+import json
+import sqlite3
+import sys
+from dataclasses import dataclass, field
+
+from message import MERGED_PATH, iter_lines, json_loads
+
+# Keeps track of what's already been uploaded to Convex so a refresh only
+# sends what changed instead of `convex import --replace`-ing everything.
+#
+# The manifest maps every published message id to a hash of its
+# `Message.to_dict` record. `prepare()` streams merged.jsonl against it and
+# writes
+#   * delta.jsonl: records that are new or whose content changed, for
+#     `convex import --append`
+#   * tombstones.json: ids to delete first, i.e. messages that disappeared
+#     plus the old copies of changed ones (--append can't overwrite)
+# The new manifest is staged and only becomes the published one once
+# `commit()` is called after the upload went through. An upload that failed
+# (or was never confirmed) may still have appended some of its records, so
+# the next `prepare()` tombstones every id the unconfirmed stage would have
+# appended before the retry appends them again; deleting an id Convex
+# doesn't have is a no-op, a second copy isn't.
+
+MANIFEST_PATH = '../output/published.sqlite'
+DELTA_PATH = '../output/delta.jsonl'
+TOMBSTONES_PATH = '../output/tombstones.json'
+
+
+def content_hash(record) -> str:
+    return hashlib.sha1(json.dumps(record, sort_keys=True).encode()).hexdigest()
+
+
+@dataclass
+class Delta:
+    added: int = 0
+    changed: int = 0
+    unchanged: int = 0
+    tombstones: list = field(default_factory=list)
+    # nothing was ever published, the whole history has to go up
+    full: bool = False
+
+    def is_empty(self):
+        return not (self.added or self.changed or self.tombstones)
+
+
+class Manifest:
+    def __init__(self, path=MANIFEST_PATH):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS published (id TEXT PRIMARY KEY, hash TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS pending (id TEXT PRIMARY KEY, hash TEXT NOT NULL);
+        ''')
+
+    def prepare(self, merged_path=MERGED_PATH, delta_path=DELTA_PATH, tombstones_path=TOMBSTONES_PATH) -> Delta:
+        conn = self.conn
+        delta = Delta()
+        delta.full = conn.execute('SELECT 1 FROM published LIMIT 1').fetchone() is None
+        # what the last unconfirmed upload may have appended: new or changed ids
+        unconfirmed = [
+            row[0] for row in conn.execute(
+                'SELECT pending.id FROM pending LEFT JOIN published USING (id) '
+                'WHERE published.hash IS NOT pending.hash'
+            )
+        ]
+        conn.execute('DELETE FROM pending')
+
+        with open(delta_path, 'w') as out:
+            for line in iter_lines(merged_path):
+                if not line.strip():
+                    continue
+                record = json_loads(line)
+                digest = content_hash(record)
+                conn.execute('INSERT OR REPLACE INTO pending (id, hash) VALUES (?, ?)', (record['id'], digest))
+                row = conn.execute('SELECT hash FROM published WHERE id = ?', (record['id'],)).fetchone()
+                if row is None:
+                    delta.added += 1
+                elif row[0] != digest:
+                    delta.changed += 1
+                    delta.tombstones.append(record['id'])
+                else:
+                    delta.unchanged += 1
+                    continue
+                out.write(json.dumps(record) + '\n')
+
+        delta.tombstones.extend(
+            row[0] for row in conn.execute('SELECT id FROM published WHERE id NOT IN (SELECT id FROM pending)')
+        )
+        seen = set(delta.tombstones)
+        delta.tombstones.extend(message_id for message_id in unconfirmed if message_id not in seen)
+        conn.commit()
+        with open(tombstones_path, 'w') as f:
+            json.dump(delta.tombstones, f)
+        return delta
+
+    def commit(self):
+        """Make the staged manifest the published one, once the upload succeeded."""
+        with self.conn:
+            self.conn.execute('DELETE FROM published')
+            self.conn.execute('INSERT INTO published SELECT id, hash FROM pending')
+            self.conn.execute('DELETE FROM pending')
+
+    def close(self):
+        self.conn.close()
+
+
+def main(args):
+    manifest = Manifest()
+    if '--commit' in args:
+        manifest.commit()
+        print('Marked the prepared delta as published')
+    else:
+        delta = manifest.prepare()
+        print(
+            f'{delta.added} new, {delta.changed} changed, {delta.unchanged} unchanged, '
+            f'{len(delta.tombstones)} tombstones'
+        )
+    manifest.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,273 @@
+import math
+from array import array
+from collections import Counter
+
+import vectorized
+from message import epoch_day_to_date
+
+np = vectorized.np
+
+# Response-time engine used by the `response_times` metric. It collects
+# (epoch seconds, sender) pairs, sorts them once (or not at all if they
+# already arrive in order), and finds sender transitions with array diffs.
+# One fold produces the per-day, per-sender and overall aggregates plus a
+# quantile sketch per sender.
+
+DEFAULT_SENDERS = ("stephen", "nadia")
+DEFAULT_CUTOFF = 86400
+PERCENTILES = (50, 90, 99)
+
+
+class QuantileSketch:
+    """
+    Streaming quantile sketch with log-spaced buckets (DDSketch style).
+
+    Quantiles are within `alpha` relative error, memory grows with the log
+    of the value range rather than the number of values, and two sketches
+    merge by adding bucket counts.
+    """
+
+    def __init__(self, alpha=0.01):
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = Counter()
+        self.zeros = 0
+        self.count = 0
+
+    def add(self, value):
+        if value <= 0:
+            self.zeros += 1
+        else:
+            self.buckets[math.ceil(math.log(value) / self.log_gamma)] += 1
+        self.count += 1
+
+    def add_many(self, values):
+        if np is None:
+            for value in values:
+                self.add(value)
+            return
+        values = np.asarray(values, dtype=np.float64)
+        positive = values[values > 0]
+        self.zeros += len(values) - len(positive)
+        self.count += len(values)
+        if len(positive):
+            keys, counts = np.unique(np.ceil(np.log(positive) / self.log_gamma), return_counts=True)
+            self.buckets.update(dict(zip(keys.astype(np.int64).tolist(), counts.tolist())))
+
+    def merge(self, other):
+        self.buckets.update(other.buckets)
+        self.zeros += other.zeros
+        self.count += other.count
+
+    def quantile(self, q):
+        if not self.count:
+            return 0
+        rank = q * (self.count - 1)
+        if rank < self.zeros:
+            return 0
+        seen = self.zeros
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen > rank:
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+    def state(self):
+        return {
+            "alpha": self.alpha,
+            "zeros": self.zeros,
+            "buckets": {str(key): count for key, count in self.buckets.items()},
+        }
+
+    @staticmethod
+    def from_state(state):
+        sketch = QuantileSketch(state["alpha"])
+        sketch.zeros = state["zeros"]
+        sketch.buckets = Counter({int(key): count for key, count in state["buckets"].items()})
+        sketch.count = sketch.zeros + sum(sketch.buckets.values())
+        return sketch
+
+
+def _avg(total, count):
+    return total / count if count > 0 else 0
+
+
+class ResponseTimeEngine:
+    """
+    A response is a message from a tracked sender that directly follows a
+    message from a different tracked sender within `cutoff` seconds; it's
+    credited to the responder. Per-day numbers only count responses whose
+    previous message was on the same day.
+    """
+
+    def __init__(self, senders=DEFAULT_SENDERS, cutoff=DEFAULT_CUTOFF):
+        self.senders = [sender.lower() for sender in senders]
+        self.cutoff = cutoff
+        # every sender seen gets a code; only `senders` are tracked
+        self.names = []
+        self.codes = {}
+        self.pending_ts = array('q')
+        self.pending_codes = array('H')
+        self.day_sums = {}
+        self.totals = {sender: [0, 0] for sender in self.senders}
+        self.sketches = {sender: QuantileSketch() for sender in self.senders + ["combined"]}
+        self.last = None
+
+    def code(self, sender):
+        code = self.codes.get(sender)
+        if code is None:
+            code = self.codes[sender] = len(self.names)
+            self.names.append(sender)
+        return code
+
+    def add(self, ts, sender):
+        self.pending_ts.append(ts)
+        self.pending_codes.append(self.code(sender.lower()))
+
+    def add_columns(self, timestamps, sender_codes, senders):
+        """Bulk add from `MessageStore` columns, translating its sender codes."""
+        mapping = [self.code(sender.lower()) for sender in senders]
+        self.pending_ts.extend(timestamps)
+        self.pending_codes.extend(mapping[code] for code in sender_codes)
+
+    def extend(self, other):
+        # `other` saw messages after ours in input order, but not necessarily
+        # later in time, so its pairs just join ours until the next fold
+        if other.last is not None:
+            raise ValueError("can't merge an already folded response time engine")
+        mapping = [self.code(sender) for sender in other.names]
+        self.pending_ts.extend(other.pending_ts)
+        self.pending_codes.extend(mapping[code] for code in other.pending_codes)
+
+    def fold(self):
+        """Sort pending pairs and fold them into the running sums, after `last`."""
+        if not self.pending_ts:
+            return
+        if np is not None:
+            self._fold_numpy()
+        else:
+            self._fold_python()
+        self.pending_ts = array('q')
+        self.pending_codes = array('H')
+
+    def _tracked(self):
+        senders = set(self.senders)
+        return [name in senders for name in self.names]
+
+    def _record(self, sender, diff, day):
+        self.totals[sender][0] += diff
+        self.totals[sender][1] += 1
+        if day is not None:
+            sums = self.day_sums.setdefault(day, {s: [0, 0] for s in self.senders})
+            sums[sender][0] += diff
+            sums[sender][1] += 1
+
+    def _fold_python(self):
+        tracked = self._tracked()
+        pairs = sorted(zip(self.pending_ts, self.pending_codes), key=lambda pair: pair[0])
+        diffs = {sender: [] for sender in self.senders}
+        prev = self.last
+        for ts, code in pairs:
+            if prev is not None and code != prev[1]:
+                diff = ts - prev[0]
+                if diff <= self.cutoff and tracked[code] and tracked[prev[1]]:
+                    sender = self.names[code]
+                    day = ts // 86400
+                    self._record(sender, diff, day if day == prev[0] // 86400 else None)
+                    diffs[sender].append(diff)
+            prev = (ts, code)
+        self.last = prev
+        for sender, values in diffs.items():
+            self.sketches[sender].add_many(values)
+            self.sketches["combined"].add_many(values)
+
+    def _fold_numpy(self):
+        ts = np.frombuffer(self.pending_ts, dtype=np.int64)
+        codes = np.frombuffer(self.pending_codes, dtype=np.uint16).astype(np.int64)
+        # trust input that is already in time order, otherwise sort once
+        if len(ts) > 1 and not np.all(ts[1:] >= ts[:-1]):
+            order = np.argsort(ts, kind="stable")
+            ts = ts[order]
+            codes = codes[order]
+        new_last = (int(ts[-1]), int(codes[-1]))
+        if self.last is not None:
+            ts = np.concatenate(([self.last[0]], ts))
+            codes = np.concatenate(([self.last[1]], codes))
+        self.last = new_last
+
+        tracked = np.array(self._tracked(), dtype=bool)
+        prev_codes = codes[:-1]
+        cur_codes = codes[1:]
+        diffs = ts[1:] - ts[:-1]
+        mask = (cur_codes != prev_codes) & (diffs <= self.cutoff) & tracked[cur_codes] & tracked[prev_codes]
+
+        responders = cur_codes[mask]
+        diffs = diffs[mask]
+        days = ts[1:][mask] // 86400
+        same_day = days == ts[:-1][mask] // 86400
+
+        for code in np.unique(responders).tolist():
+            sender = self.names[code]
+            values = diffs[responders == code]
+            self.totals[sender][0] += int(values.sum())
+            self.totals[sender][1] += len(values)
+            self.sketches[sender].add_many(values)
+            self.sketches["combined"].add_many(values)
+
+        n = len(self.names)
+        keys, inverse, counts = np.unique(
+            days[same_day] * n + responders[same_day], return_inverse=True, return_counts=True
+        )
+        sums = np.bincount(inverse, weights=diffs[same_day], minlength=len(keys))
+        for key, total, count in zip(keys.tolist(), sums.tolist(), counts.tolist()):
+            day, code = divmod(key, n)
+            day_sums = self.day_sums.setdefault(day, {s: [0, 0] for s in self.senders})
+            day_sums[self.names[code]][0] += int(total)
+            day_sums[self.names[code]][1] += count
+
+    def results(self):
+        """(per-day breakdown, per-day combined average, overall averages, percentiles)"""
+        self.fold()
+        breakdown = {}
+        total_avg = {}
+        for day, sums in self.day_sums.items():
+            day = epoch_day_to_date(day)
+            breakdown[day] = {s: _avg(*sums[s]) for s in self.senders}
+            total_avg[day] = _avg(
+                sum(total for total, _ in sums.values()),
+                sum(count for _, count in sums.values()),
+            )
+
+        overall = {s: _avg(*self.totals[s]) for s in self.senders}
+        overall["combined"] = _avg(
+            sum(total for total, _ in self.totals.values()),
+            sum(count for _, count in self.totals.values()),
+        )
+
+        percentiles = {
+            sender: {f"p{p}": sketch.quantile(p / 100) for p in PERCENTILES}
+            for sender, sketch in self.sketches.items()
+        }
+        return breakdown, total_avg, overall, percentiles
+
+    def state(self):
+        self.fold()
+        return {
+            "senders": self.senders,
+            "cutoff": self.cutoff,
+            "day_sums": {str(day): sums for day, sums in self.day_sums.items()},
+            "totals": self.totals,
+            "sketches": {sender: sketch.state() for sender, sketch in self.sketches.items()},
+            "last": [self.last[0], self.names[self.last[1]]] if self.last else None,
+        }
+
+    def load_state(self, state):
+        self.__init__(state["senders"], state["cutoff"])
+        self.day_sums = {int(day): sums for day, sums in state["day_sums"].items()}
+        self.totals = state["totals"]
+        self.sketches = {
+            sender: QuantileSketch.from_state(sketch) for sender, sketch in state["sketches"].items()
+        }
+        last = state["last"]
+        self.last = (last[0], self.code(last[1])) if last else None
@@ -0,0 +1,319 @@
+import json
+import os
+import shutil
+import sys
+from collections import Counter
+from datetime import date, timedelta
+from pathlib import Path
+
+from message import epoch_day_to_date
+
+# Pre-aggregated analytics per day, week, month and year, so a date range
+# can be summed from a few buckets instead of recomputing from messages.
+#
+# Every bucket holds the message count per sender, the top words and
+# emojis as mergeable top-k summaries (`TopK`), and the response-time sum
+# and count per sender. `analytics.py all` builds the day buckets from its
+# metrics (message_frequency_per_day_per_person, response_times and
+# day_tokens) and rolls them up: weeks start on Monday, and a week belongs
+# to the year it starts in.
+#
+# The output is sharded by period under ../output/rollups/ so a consumer
+# only loads what it shows:
+#
+#   index.json            levels, shard files, first and last day
+#   years.json            every year
+#   months/<YYYY>.json    the months of a year
+#   weeks/<YYYY>.json     the weeks starting in a year
+#   days/<YYYY-MM>.json   the days of a month
+#
+# `Rollups.aggregate(start, end)` answers an arbitrary range of days by
+# walking it with the biggest bucket that fits at each step (a whole year,
+# else a whole month, else a whole week, else a day), so a range of years
+# costs a few dozen buckets rather than every day in it.
+#
+# Response times only count responses whose previous message was on the
+# same day, like average_response_time_per_day, so a range's average can
+# differ slightly from the overall number for the same messages.
+
+ROLLUPS_DIR = Path('../output/rollups')
+CAPACITY = 200
+TOP = 20
+LEVELS = ('year', 'month', 'week', 'day')
+
+
+class TopK:
+    """
+    Misra-Gries summary: at most `capacity` items with counts that are
+    exact while fewer distinct items have been seen, and otherwise low by
+    at most total / (capacity + 1). Two summaries merge by adding their
+    counts and pruning again, with the same bound for the combined total.
+    """
+
+    def __init__(self, capacity=CAPACITY, counts=None):
+        self.capacity = capacity
+        self.counts = Counter(counts or {})
+
+    def update(self, items):
+        self.counts.update(items)
+        # prune in batches, not on every new item
+        if len(self.counts) > 4 * self.capacity:
+            self.prune()
+
+    def merge(self, other):
+        self.counts.update(other.counts)
+        if len(self.counts) > self.capacity:
+            self.prune()
+
+    def prune(self):
+        if len(self.counts) <= self.capacity:
+            return
+        # subtract the (capacity + 1)th largest count from everything
+        cut = sorted(self.counts.values(), reverse=True)[self.capacity]
+        self.counts = Counter({item: count - cut for item, count in self.counts.items() if count > cut})
+
+    def ranked(self):
+        # ties broken by the item, so the order doesn't depend on the order
+        # things were counted in (e.g. after an incremental run)
+        return sorted(self.counts.items(), key=lambda item: (-item[1], item[0]))
+
+    def top(self, n=TOP):
+        return self.ranked()[:n]
+
+    def state(self):
+        self.prune()
+        return [[item, count] for item, count in self.ranked()]
+
+    @staticmethod
+    def from_state(state, capacity=CAPACITY):
+        return TopK(capacity, {item: count for item, count in state})
+
+
+class Bucket:
+    def __init__(self, start: date, end: date):
+        # inclusive
+        self.start = start
+        self.end = end
+        self.messages = Counter()
+        self.words = TopK()
+        self.emojis = TopK()
+        # sender -> [total seconds, responses]
+        self.responses = {}
+
+    def merge(self, other):
+        self.messages.update(other.messages)
+        self.words.merge(other.words)
+        self.emojis.merge(other.emojis)
+        for sender, (total, count) in other.responses.items():
+            sums = self.responses.setdefault(sender, [0, 0])
+            sums[0] += total
+            sums[1] += count
+
+    def summary(self, top=TOP) -> dict:
+        """What a consumer wants to show: counts, top items, average response times."""
+        return {
+            'start': str(self.start),
+            'end': str(self.end),
+            'messages': dict(self.messages, total=sum(self.messages.values())),
+            'top_words': self.words.top(top),
+            'top_emojis': self.emojis.top(top),
+            'average_response_time': {
+                sender: total / count if count else 0 for sender, (total, count) in self.responses.items()
+            },
+        }
+
+    def state(self) -> dict:
+        return {
+            'start': str(self.start),
+            'end': str(self.end),
+            'messages': dict(self.messages),
+            'words': self.words.state(),
+            'emojis': self.emojis.state(),
+            'responses': self.responses,
+        }
+
+    @staticmethod
+    def from_state(state):
+        bucket = Bucket(date.fromisoformat(state['start']), date.fromisoformat(state['end']))
+        bucket.messages = Counter(state['messages'])
+        bucket.words = TopK.from_state(state['words'])
+        bucket.emojis = TopK.from_state(state['emojis'])
+        bucket.responses = {sender: list(sums) for sender, sums in state['responses'].items()}
+        return bucket
+
+
+def week_start(day: date) -> date:
+    return day - timedelta(days=day.weekday())
+
+
+def month_end(day: date) -> date:
+    first_of_next = date(day.year + day.month // 12, day.month % 12 + 1, 1)
+    return first_of_next - timedelta(days=1)
+
+
+def period(level, day: date):
+    """(key, first day, last day) of the `level` bucket containing `day`."""
+    if level == 'day':
+        return str(day), day, day
+    if level == 'week':
+        start = week_start(day)
+        return str(start), start, start + timedelta(days=6)
+    if level == 'month':
+        start = day.replace(day=1)
+        return start.strftime('%Y-%m'), start, month_end(day)
+    if level == 'year':
+        return str(day.year), date(day.year, 1, 1), date(day.year, 12, 31)
+    raise ValueError(f'unknown level {level!r}')
+
+
+def shard_name(level, key: str) -> str:
+    if level == 'year':
+        return 'years.json'
+    if level == 'day':
+        return f'days/{key[:7]}.json'
+    return f'{level}s/{key[:4]}.json'
+
+
+def day_buckets(day_counts, day_responses, day_tokens) -> dict:
+    """
+    {date: Bucket} from the per-day metrics: {date: Counter(sender)},
+    {epoch day: {sender: [total, count]}} and {date: (words, emojis)}.
+    """
+    days = {}
+
+    def bucket(day):
+        if day not in days:
+            days[day] = Bucket(day, day)
+        return days[day]
+
+    for day, counts in day_counts.items():
+        bucket(day).messages.update(counts)
+    for epoch_day, sums in day_responses.items():
+        responses = bucket(epoch_day_to_date(epoch_day)).responses
+        for sender, (total, count) in sums.items():
+            responses[sender] = [total, count]
+    for day, (words, emojis) in day_tokens.items():
+        b = bucket(day)
+        b.words.merge(words)
+        b.emojis.merge(emojis)
+    return days
+
+
+def roll_up(days: dict) -> dict:
+    """{level: {key: Bucket}} with every level built from the day buckets."""
+    levels = {level: {} for level in LEVELS}
+    for day in sorted(days):
+        for level in LEVELS:
+            key, start, end = period(level, day)
+            bucket = levels[level].get(key)
+            if bucket is None:
+                bucket = levels[level][key] = Bucket(start, end)
+            bucket.merge(days[day])
+    return levels
+
+
+def write(levels, path=ROLLUPS_DIR):
+    path = Path(path)
+    tmp = path.with_name(path.name + '.tmp')
+    if tmp.exists():
+        shutil.rmtree(tmp)
+    shards = {}
+    for level, buckets in levels.items():
+        for key in sorted(buckets):
+            shards.setdefault(shard_name(level, key), {})[key] = buckets[key].state()
+    for name, buckets in shards.items():
+        shard_path = tmp / name
+        shard_path.parent.mkdir(parents=True, exist_ok=True)
+        with shard_path.open('w', encoding='utf-8') as f:
+            json.dump(buckets, f, ensure_ascii=False)
+
+    days = sorted(levels['day'])
+    index = {
+        'levels': list(LEVELS),
+        'capacity': CAPACITY,
+        'first_day': days[0] if days else None,
+        'last_day': days[-1] if days else None,
+        'shards': sorted(shards),
+    }
+    tmp.mkdir(parents=True, exist_ok=True)
+    with (tmp / 'index.json').open('w', encoding='utf-8') as f:
+        json.dump(index, f, indent=2)
+
+    # swap the whole directory so readers never mix two runs
+    if path.exists():
+        old = path.with_name(path.name + '.old')
+        os.replace(path, old)
+        os.replace(tmp, path)
+        shutil.rmtree(old)
+    else:
+        os.replace(tmp, path)
+    print(f'Rollups written to {path}')
+
+
+def build(metrics, path=ROLLUPS_DIR):
+    """Write the rollups from `analytics.py all`'s finalized metrics."""
+    by_name = {metric.name: metric for metric in metrics}
+    days = day_buckets(
+        by_name['message_frequency_per_day_per_person'].freq,
+        by_name['response_times'].engine.day_sums,
+        by_name['day_tokens'].days,
+    )
+    write(roll_up(days), path)
+
+
+class Rollups:
+    """Reads the sharded rollups, loading each shard the first time it's needed."""
+
+    def __init__(self, path=ROLLUPS_DIR):
+        self.path = Path(path)
+        with (self.path / 'index.json').open(encoding='utf-8') as f:
+            self.index = json.load(f)
+        self.shards = {}
+
+    def shard(self, name) -> dict:
+        if name not in self.shards:
+            shard_path = self.path / name
+            if shard_path.exists():
+                with shard_path.open(encoding='utf-8') as f:
+                    self.shards[name] = json.load(f)
+            else:
+                self.shards[name] = {}
+        return self.shards[name]
+
+    def bucket(self, level, key):
+        """The stored bucket, or None if that period had no messages."""
+        state = self.shard(shard_name(level, key)).get(key)
+        return Bucket.from_state(state) if state is not None else None
+
+    def cover(self, start: date, end: date):
+        """(level, key) of the fewest buckets that exactly cover start..end, biggest first."""
+        cover = []
+        day = start
+        while day <= end:
+            for level in LEVELS:
+                key, first, last = period(level, day)
+                if first == day and last <= end:
+                    cover.append((level, key))
+                    day = last + timedelta(days=1)
+                    break
+        return cover
+
+    def aggregate(self, start: date, end: date) -> Bucket:
+        """Everything from `start` to `end` (inclusive) combined into one bucket."""
+        total = Bucket(start, end)
+        for level, key in self.cover(start, end):
+            bucket = self.bucket(level, key)
+            if bucket is not None:
+                total.merge(bucket)
+        return total
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 4 and sys.argv[1] == 'query':
+        rollups = Rollups()
+        start, end = date.fromisoformat(sys.argv[2]), date.fromisoformat(sys.argv[3])
+        print(json.dumps(rollups.aggregate(start, end).summary(), ensure_ascii=False, indent=2))
+        print(f'({len(rollups.cover(start, end))} buckets, {len(rollups.shards)} shards read)', file=sys.stderr)
+    else:
+        print('usage: rollups.py query START END   (dates as YYYY-MM-DD, inclusive; '
+              'written by `analytics.py all`)')
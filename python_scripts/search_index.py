@@ -0,0 +1,466 @@
+import functools
+import math
+import mmap
+import os
+import re
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from itertools import accumulate
+from typing import NamedTuple
+
+import fingerprint
+import vectorized
+from message import MERGED_PATH, iter_lines, records_from_lines, timestamp_to_epoch, to_epoch
+
+# Inverted index over merged.jsonl, for keyword search without Convex.
+#
+#   header     magic, format version, message count, term count, total
+#              token count, fingerprint digest of the merged.jsonl it was
+#              built from (fingerprint.py), offsets of the term strings and
+#              the term table
+#   epochs     int64 epoch seconds per message, in merged.jsonl order
+#   lengths    uint16 token count per message (for ranking)
+#   postings   per term, the message numbers it appears in as varint
+#              deltas, each followed by a varint count of occurrences
+#   positions  per term, the token positions of every occurrence, as
+#              varint deltas within each message
+#   terms      the terms, utf-8, sorted bytewise
+#   table      per term: offset and length of its string, number of
+#              messages, offsets of its postings and positions; plus one
+#              closing entry so every run ends where the next one starts
+#
+# A message's number is its line in merged.jsonl, so hits can be fetched
+# from the memory-mapped file (mmap_reader.py). Tokens are lowercased \w+
+# runs. A query is words and "quoted phrases", all of which have to match,
+# with OR between alternatives: `coffee "good morning" OR tea`. Hits can
+# be limited to a date range (two bisects over the epochs, then a slice of
+# each posting list) and come back ranked by BM25, or newest/oldest first,
+# a page at a time.
+#
+# merge.py writes it together with merged.jsonl once it exists (or with
+# `merge.py --search`); `search_index.py build` builds it afterwards.
+
+INDEX_PATH = '../output/merged.sidx'
+MAGIC = b'NMDBSIX1'
+VERSION = 2
+HEADER = struct.Struct('<8sQQQQ32sQQ')
+PREFIX = struct.Struct('<8sQ')
+TERM = struct.Struct('<QIIQQ')
+TOKEN_RE = re.compile(r'\w+')
+QUERY_RE = re.compile(r'"([^"]*)"|(\S+)')
+MAX_LENGTH = 0xFFFF
+CACHE_SIZE = 256
+QUERY_CACHE_SIZE = 16
+# shorter runs decode faster in plain Python than through NumPy
+VECTORIZE_BYTES = 256
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+
+def tokenize(text: str) -> list:
+    return TOKEN_RE.findall(text.lower())
+
+
+def encode_varint(value: int, out: bytearray):
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def decode_varints(buf, pos: int, end: int) -> list:
+    values = []
+    value = shift = 0
+    while pos < end:
+        byte = buf[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            values.append(value)
+            value = shift = 0
+    return values
+
+
+class SearchIndexWriter:
+    def __init__(self):
+        self.epochs = array('q')
+        self.lengths = array('H')
+        self.total_tokens = 0
+        # term -> [postings, positions, last message number, message count]
+        self.terms = {}
+
+    def add(self, record):
+        doc = len(self.epochs)
+        self.epochs.append(timestamp_to_epoch(record['timestamp']))
+        tokens = tokenize(record['message'])
+        self.lengths.append(min(len(tokens), MAX_LENGTH))
+        self.total_tokens += len(tokens)
+
+        occurrences = {}
+        for position, token in enumerate(tokens):
+            occurrences.setdefault(token, []).append(position)
+        for token, positions in occurrences.items():
+            entry = self.terms.get(token)
+            if entry is None:
+                entry = self.terms[token] = [bytearray(), bytearray(), 0, 0]
+            postings, position_bytes, last, _ = entry
+            encode_varint(doc - last, postings)
+            encode_varint(len(positions), postings)
+            prev = 0
+            for position in positions:
+                encode_varint(position - prev, position_bytes)
+                prev = position
+            entry[2] = doc
+            entry[3] += 1
+
+    def write(self, jsonl_digest: str, path=INDEX_PATH):
+        count = len(self.epochs)
+        terms = sorted((term.encode(), entry) for term, entry in self.terms.items())
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(b'\x00' * HEADER.size)
+            f.write(self.epochs.tobytes())
+            f.write(self.lengths.tobytes())
+
+            postings_offsets = []
+            for _, (postings, _, _, _) in terms:
+                postings_offsets.append(f.tell())
+                f.write(postings)
+            positions_start = f.tell()
+            positions_offsets = []
+            for _, (_, positions, _, _) in terms:
+                positions_offsets.append(f.tell())
+                f.write(positions)
+            end = f.tell()
+
+            terms_offset = f.tell()
+            term_offsets = []
+            for term, _ in terms:
+                term_offsets.append(f.tell())
+                f.write(term)
+
+            table_offset = f.tell()
+            for (term, (_, _, _, df)), term_offset, postings_offset, positions_offset in zip(
+                terms, term_offsets, postings_offsets, positions_offsets,
+            ):
+                f.write(TERM.pack(term_offset, len(term), df, postings_offset, positions_offset))
+            f.write(TERM.pack(table_offset, 0, 0, positions_start, end))
+
+            f.seek(0)
+            f.write(HEADER.pack(
+                MAGIC, VERSION, count, len(terms), self.total_tokens, jsonl_digest.encode(), terms_offset, table_offset,
+            ))
+        os.replace(tmp_path, path)
+
+
+class _Terms:
+    """Read-only sequence over the sorted term strings, for bisect."""
+
+    def __init__(self, index):
+        self.index = index
+
+    def __len__(self):
+        return self.index.term_count
+
+    def __getitem__(self, i):
+        term_offset, term_length = self.index.entry(i)[:2]
+        return self.index.mm[term_offset:term_offset + term_length]
+
+
+class Postings(NamedTuple):
+    # message numbers, ascending
+    docs: list
+    # occurrences in each of them
+    counts: list
+
+
+class SearchResults(NamedTuple):
+    # every matching message, not just this page
+    total: int
+    # (message number, score) for the page
+    hits: list
+
+
+class SearchIndex:
+    def __init__(self, path=INDEX_PATH):
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = PREFIX.unpack_from(self.mm)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a search index')
+        if version != VERSION:
+            raise ValueError(f'{path} is search index format v{version}, this reader only reads v{VERSION}')
+        (
+            _, _, self.count, self.term_count, self.total_tokens,
+            jsonl_digest, self.terms_offset, self.table_offset,
+        ) = HEADER.unpack_from(self.mm)
+        self.jsonl_digest = jsonl_digest.decode()
+        self.view = memoryview(self.mm)
+        self.epochs = self.view[HEADER.size:HEADER.size + 8 * self.count].cast('q')
+        lengths_start = HEADER.size + 8 * self.count
+        self.lengths = self.view[lengths_start:lengths_start + 2 * self.count].cast('H')
+        self.average_length = self.total_tokens / self.count if self.count else 0
+        self.terms = _Terms(self)
+        # a query reads each term's postings a few times (matching, phrase
+        # positions, scoring), and pages of one query read them all again
+        self.postings = functools.lru_cache(maxsize=CACHE_SIZE)(self._postings)
+        self.positions = functools.lru_cache(maxsize=CACHE_SIZE)(self._positions)
+        self.ranked = functools.lru_cache(maxsize=QUERY_CACHE_SIZE)(self._ranked)
+
+    def __len__(self):
+        return self.count
+
+    def matches(self, jsonl_path=MERGED_PATH) -> bool:
+        """Whether `jsonl_path` is the merged.jsonl this index was built from."""
+        return fingerprint.matches(jsonl_path, self.jsonl_digest)
+
+    def entry(self, i):
+        return TERM.unpack_from(self.mm, self.table_offset + i * TERM.size)
+
+    def lookup(self, term: str):
+        """Table position of `term`, or None."""
+        key = term.encode()
+        i = bisect_left(self.terms, key)
+        if i < self.term_count and self.terms[i] == key:
+            return i
+        return None
+
+    def _decode(self, start, end) -> list:
+        if vectorized.available() and end - start > VECTORIZE_BYTES:
+            return vectorized.decode_varints(self.mm[start:end])
+        return decode_varints(self.mm, start, end)
+
+    def document_frequency(self, term: str) -> int:
+        i = self.lookup(term)
+        return 0 if i is None else self.entry(i)[2]
+
+    def _postings(self, term: str) -> Postings:
+        i = self.lookup(term)
+        if i is None:
+            return Postings([], [])
+        values = self._decode(self.entry(i)[3], self.entry(i + 1)[3])
+        return Postings(list(accumulate(values[0::2])), values[1::2])
+
+    def _positions(self, term: str) -> dict:
+        """{message number: token positions} for `term`."""
+        i = self.lookup(term)
+        if i is None:
+            return {}
+        postings = self.postings(term)
+        deltas = self._decode(self.entry(i)[4], self.entry(i + 1)[4])
+        positions = {}
+        k = 0
+        for doc, count in zip(postings.docs, postings.counts):
+            positions[doc] = list(accumulate(deltas[k:k + count]))
+            k += count
+        return positions
+
+    def span(self, start=None, end=None):
+        """Message numbers [first, last) with start <= epoch seconds < end."""
+        first = 0 if start is None else bisect_left(self.epochs, start)
+        last = self.count if end is None else bisect_left(self.epochs, end)
+        return first, last
+
+    def _phrase_docs(self, words, first, last) -> set:
+        """Message numbers in [first, last) containing `words` in a row."""
+        docs = None
+        # rarest first, the intersection is small from the start
+        for word in sorted(set(words), key=self.document_frequency):
+            p = self.postings(word)
+            window = p.docs[bisect_left(p.docs, first):bisect_left(p.docs, last)]
+            docs = set(window) if docs is None else docs.intersection(window)
+            if not docs:
+                return set()
+        if len(words) == 1:
+            return docs
+        positions = [self.positions(word) for word in words]
+        found = set()
+        for doc in docs:
+            starts = set(positions[0][doc])
+            for offset, word_positions in enumerate(positions[1:], 1):
+                starts.intersection_update(position - offset for position in word_positions[doc])
+                if not starts:
+                    break
+            if starts:
+                found.add(doc)
+        return found
+
+    def _score(self, docs, words) -> dict:
+        """BM25 of every message in `docs` for the query `words`."""
+        scores = dict.fromkeys(docs, 0.0)
+        if not docs:
+            return scores
+        first, last = min(docs), max(docs) + 1
+        for word in set(words):
+            postings = self.postings(word)
+            df = len(postings.docs)
+            idf = math.log(1 + (self.count - df + 0.5) / (df + 0.5))
+            lo, hi = bisect_left(postings.docs, first), bisect_left(postings.docs, last)
+            for doc, count in zip(postings.docs[lo:hi], postings.counts[lo:hi]):
+                if doc in scores:
+                    norm = 1 - B + B * self.lengths[doc] / self.average_length
+                    scores[doc] += idf * count * (K1 + 1) / (count + K1 * norm)
+        return scores
+
+    def _ranked(self, query, start, end, order) -> list:
+        """Every hit of a query as (message number, score), in result order."""
+        first, last = self.span(start, end)
+        alternatives = parse_query(query)
+        docs = set()
+        for alternative in alternatives:
+            matched = None
+            for phrase in alternative:
+                phrase_docs = self._phrase_docs(phrase, first, last)
+                matched = phrase_docs if matched is None else matched & phrase_docs
+                if not matched:
+                    break
+            docs |= matched or set()
+
+        if order == 'rank':
+            words = [word for alternative in alternatives for phrase in alternative for word in phrase]
+            scores = self._score(docs, words)
+            # (score, number) tuples sort natively, newer first on ties
+            ranked = sorted(zip(scores.values(), scores.keys()), reverse=True)
+            return [(doc, score) for score, doc in ranked]
+        if order == 'newest':
+            return [(doc, None) for doc in sorted(docs, reverse=True)]
+        if order == 'oldest':
+            return [(doc, None) for doc in sorted(docs)]
+        raise ValueError(f'unknown order {order!r}')
+
+    def search(self, query: str, start=None, end=None, limit=20, offset=0, order='rank') -> SearchResults:
+        """
+        Messages matching `query`, optionally with start <= epoch < end.
+        `order` is 'rank' (BM25, newer first on ties), 'newest' or 'oldest';
+        `offset` and `limit` pick the page. The full ranking of the last few
+        queries is kept, so the next page is just a slice.
+        """
+        ranked = self.ranked(query, start, end, order)
+        return SearchResults(len(ranked), ranked[offset:offset + limit])
+
+    def close(self):
+        self.postings.cache_clear()
+        self.positions.cache_clear()
+        self.ranked.cache_clear()
+        for view in (self.epochs, self.lengths, self.view):
+            view.release()
+        self.mm.close()
+
+
+def parse_query(query: str) -> list:
+    """
+    Alternatives (split on OR) of phrases that all have to match, each a
+    list of tokens: 'a "b c" OR d' -> [[['a'], ['b', 'c']], [['d']]].
+    """
+    alternatives = [[]]
+    for match in QUERY_RE.finditer(query):
+        quoted, word = match.groups()
+        if word == 'OR':
+            alternatives.append([])
+            continue
+        # a word like "don't" is a phrase of its tokens
+        tokens = tokenize(quoted if quoted is not None else word)
+        if tokens:
+            alternatives[-1].append(tokens)
+    return [alternative for alternative in alternatives if alternative]
+
+
+def open_search_index(path=INDEX_PATH, jsonl_path=MERGED_PATH):
+    """The search index for merged.jsonl, or None if it's missing or out of date."""
+    if not os.path.exists(path):
+        return None
+    try:
+        index = SearchIndex(path)
+    except ValueError:
+        # e.g. written in an older format; rebuilt like a stale one
+        return None
+    if not index.matches(jsonl_path):
+        index.close()
+        return None
+    return index
+
+
+def build_from_merged(path=INDEX_PATH, jsonl_path=MERGED_PATH) -> int:
+    writer = SearchIndexWriter()
+    for record in records_from_lines(iter_lines(jsonl_path)):
+        writer.add(record)
+    writer.write(fingerprint.digest(jsonl_path), path)
+    return len(writer.epochs)
+
+
+def _date_epoch(date_str: str) -> int:
+    return to_epoch(datetime.strptime(date_str, '%Y-%m-%d'))
+
+
+USAGE = ('usage: search_index.py [build | search QUERY [--from DATE] [--to DATE] '
+         '[--page N] [--limit N] [--order rank|newest|oldest]]')
+
+
+def main(args):
+    # late import: mmap_reader is only needed to print hits
+    from mmap_reader import MergedFile
+
+    terms = []
+    options = {'--from': None, '--to': None, '--page': '1', '--limit': '20', '--order': 'rank'}
+    args = iter(args)
+    for arg in args:
+        if arg in options:
+            value = next(args, None)
+            if value is None or value in options:
+                sys.exit(f'{arg} needs a value\n{USAGE}')
+            options[arg] = value
+        else:
+            terms.append(arg)
+    if len(terms) > 1:
+        # the shell already took the quotes off `"good morning"`; a single
+        # argument is a whole query (`'hungry OR sleep'`) and left alone
+        terms = [
+            f'"{term}"' if len(term.split()) > 1 and '"' not in term and 'OR' not in term.split() else term
+            for term in terms
+        ]
+    if not terms:
+        sys.exit(USAGE)
+    try:
+        limit = int(options['--limit'])
+        page = int(options['--page'])
+    except ValueError:
+        sys.exit(f'--page and --limit take a number\n{USAGE}')
+    if page < 1 or limit < 1:
+        sys.exit(f'--page and --limit start at 1\n{USAGE}')
+    if options['--order'] not in ('rank', 'newest', 'oldest'):
+        sys.exit(f'--order is rank, newest or oldest\n{USAGE}')
+
+    index = open_search_index()
+    if index is None:
+        print(f'{INDEX_PATH} is missing or older than {MERGED_PATH}; run `search_index.py build`')
+        return
+    start = _date_epoch(options['--from']) if options['--from'] else None
+    # --to is inclusive
+    end = _date_epoch(options['--to']) + int(timedelta(days=1).total_seconds()) if options['--to'] else None
+    results = index.search(' '.join(terms), start, end, limit=limit, offset=(page - 1) * limit, order=options['--order'])
+
+    merged = MergedFile()
+    pages = max(1, math.ceil(results.total / limit))
+    print(f'{results.total} messages, page {page} of {pages}')
+    for doc, score in results.hits:
+        view = merged[doc]
+        print(f"[{view['timestamp']}] {view['sender']}: {view['message']}")
+    merged.close()
+    index.close()
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command == 'build':
+        print(f'Indexed {build_from_merged()} messages in {INDEX_PATH}')
+    elif command == 'search':
+        main(sys.argv[2:])
+    else:
+        print(USAGE)
@@ -0,0 +1,88 @@
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_left
+
+import fingerprint
+from message import MERGED_PATH, timestamp_to_epoch
+
+# Sidecar index for merged.jsonl, written by merge.py as it writes the file:
+#
+#   header   b'NMDBTIX2', message count n (int64), fingerprint digest of
+#            merged.jsonl (fingerprint.py, 32 ascii bytes)
+#   epochs   n int64 epoch seconds, sorted (merged.jsonl is time-ordered)
+#   offsets  n + 1 int64 byte offsets of each line, then the file size
+#
+# At query time it's memory-mapped and a time window is two bisects over
+# the epochs; the matching lines are one contiguous byte range of
+# merged.jsonl (see mmap_reader.py).
+
+INDEX_PATH = '../output/merged.idx'
+MAGIC = b'NMDBTIX2'
+HEADER = struct.Struct('<8sq32s')
+
+
+class TimeIndexWriter:
+    def __init__(self):
+        self.epochs = array('q')
+        self.offsets = array('q', [0])
+
+    def add(self, timestamp: str, length: int):
+        """Record the next line: its timestamp string and length in bytes."""
+        self.epochs.append(timestamp_to_epoch(timestamp))
+        self.offsets.append(self.offsets[-1] + length)
+
+    def write(self, merged_digest: str, path=INDEX_PATH):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, len(self.epochs), merged_digest.encode()))
+            f.write(self.epochs.tobytes())
+            f.write(self.offsets.tobytes())
+        os.replace(tmp_path, path)
+
+
+class TimeIndex:
+    def __init__(self, path=INDEX_PATH, merged_path=MERGED_PATH):
+        self.merged_path = merged_path
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{path} is not a time index')
+        _, count, merged_digest = HEADER.unpack_from(self.mm)
+        self.merged_digest = merged_digest.decode()
+        self.view = memoryview(self.mm)[HEADER.size:].cast('q')
+        self.epochs = self.view[:count]
+        self.offsets = self.view[count:2 * count + 1]
+
+    def __len__(self):
+        return len(self.epochs)
+
+    def matches(self, merged_path=None) -> bool:
+        """Whether merged.jsonl is still the file this index was written for."""
+        merged_path = merged_path or self.merged_path
+        return fingerprint.matches(merged_path, self.merged_digest)
+
+    def span(self, start: int, end: int):
+        """Line numbers [first, last) with start <= epoch < end."""
+        return bisect_left(self.epochs, start), bisect_left(self.epochs, end)
+
+    def close(self):
+        for view in (self.epochs, self.offsets, self.view):
+            view.release()
+        self.mm.close()
+
+
+def open_index(path=INDEX_PATH, merged_path=MERGED_PATH):
+    """The index for merged.jsonl, or None if it's missing or out of date."""
+    if not os.path.exists(path):
+        return None
+    try:
+        index = TimeIndex(path, merged_path)
+    except ValueError:
+        # e.g. written in an older format; merge.py writes a new one
+        return None
+    if not index.matches():
+        index.close()
+        return None
+    return index
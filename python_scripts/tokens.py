@@ -0,0 +1,108 @@
+import functools
+import hashlib
+import json
+import re
+import sqlite3
+from typing import NamedTuple
+
+import emoji
+
+# Text features shared by the word and emoji metrics. Each distinct message
+# text is tokenized once per run: `features` is LRU-cached, so short
+# messages that repeat ("ok", "lol", "mrrr") and every metric reading the
+# same message share one result.
+#
+# Emoji scanning is the expensive part (emoji.emoji_list walks the text
+# character by character), so ASCII-only text skips it entirely, and the
+# rest can be remembered across runs in an optional SQLite cache keyed by a
+# hash of the text (`enable_disk_cache`).
+
+skip_word_list = [
+    "[",
+    "]",
+    "http",
+]
+
+ascii_pattern = re.compile(r"\b[a-zA-Z]+\b")
+
+CACHE_SIZE = 1 << 16
+DISK_CACHE_PATH = '../output/token_cache.sqlite'
+
+
+def should_skip(text):
+    return any(skip in text for skip in skip_word_list)
+
+
+class TextFeatures(NamedTuple):
+    # the message has a link or attachment marker, word metrics ignore it
+    skipped: bool
+    # number of words in the original text
+    word_count: int
+    # words of the lowercased text
+    words: tuple
+    emojis: tuple
+
+
+class EmojiCache:
+    def __init__(self, path=DISK_CACHE_PATH):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS emojis (key BLOB PRIMARY KEY, emojis TEXT NOT NULL)')
+        self.pending = []
+
+    @staticmethod
+    def key(text):
+        return hashlib.blake2b(text.encode(), digest_size=16).digest()
+
+    def get(self, key):
+        row = self.conn.execute('SELECT emojis FROM emojis WHERE key = ?', (key,)).fetchone()
+        return tuple(json.loads(row[0])) if row else None
+
+    def put(self, key, emojis):
+        self.pending.append((key, json.dumps(emojis)))
+
+    def close(self):
+        with self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO emojis (key, emojis) VALUES (?, ?)', self.pending)
+        self.pending = []
+        self.conn.close()
+
+
+_disk_cache = None
+
+
+def enable_disk_cache(path=DISK_CACHE_PATH):
+    global _disk_cache
+    _disk_cache = EmojiCache(path)
+
+
+def close_disk_cache():
+    global _disk_cache
+    if _disk_cache is not None:
+        _disk_cache.close()
+        _disk_cache = None
+
+
+def extract_emojis(text) -> tuple:
+    if text.isascii():
+        # every emoji has a non-ASCII code point
+        return ()
+    if _disk_cache is None:
+        return tuple(e["emoji"] for e in emoji.emoji_list(text))
+    key = EmojiCache.key(text)
+    emojis = _disk_cache.get(key)
+    if emojis is None:
+        emojis = tuple(e["emoji"] for e in emoji.emoji_list(text))
+        _disk_cache.put(key, emojis)
+    return emojis
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def features(text) -> TextFeatures:
+    words = tuple(ascii_pattern.findall(text.lower()))
+    if text.isascii():
+        word_count = len(words)
+    else:
+        # lowercasing non-ASCII can change the word boundaries
+        word_count = len(ascii_pattern.findall(text))
+    return TextFeatures(should_skip(text), word_count, words, extract_emojis(text))
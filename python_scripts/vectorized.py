@@ -0,0 +1,78 @@
+from collections import Counter
+from datetime import datetime
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# NumPy versions of the time-bucketed group-bys on `MessageStore`. The
+# timestamp column is turned into a datetime64 array once, hours/days/months
+# become integer keys, and counts come from np.bincount/np.unique instead
+# of per-message `datetime` calls. Without NumPy, MessageStore falls back to
+# its pure Python group-bys.
+#
+# Every result is returned in first-appearance order, same as the Counters
+# built by the reference loops in analytics.py, so analytics.json doesn't
+# change depending on which path ran.
+
+
+def available():
+    return np is not None
+
+
+class TimeColumns:
+    def __init__(self, store):
+        self.timestamps = np.frombuffer(store.timestamps, dtype=np.int64)
+        self.codes = np.frombuffer(store.sender_codes, dtype=np.uint16).astype(np.int64)
+        self.num_senders = len(store.senders)
+        seconds = self.timestamps.astype("datetime64[s]")
+        self.days = seconds.astype("datetime64[D]").astype(np.int64)
+        self.months = seconds.astype("datetime64[M]").astype(np.int64)
+        self.hours = (self.timestamps // 3600) % 24
+
+
+def ordered_counts(keys, counts=None):
+    """Counter of `keys` whose iteration order is each key's first appearance."""
+    if counts is None:
+        uniq, first, counts = np.unique(keys, return_index=True, return_counts=True)
+    else:
+        uniq, first = np.unique(keys, return_index=True)
+        counts = counts[uniq]
+    order = np.argsort(first, kind="stable")
+    return Counter(dict(zip(uniq[order].tolist(), counts[order].tolist())))
+
+
+def hour_counts(cols):
+    return ordered_counts(cols.hours, np.bincount(cols.hours, minlength=24))
+
+
+def distinct_days(cols):
+    return np.unique(cols.days).tolist()
+
+
+def day_sender_counts(cols):
+    keys = cols.days * cols.num_senders + cols.codes
+    counts = ordered_counts(keys)
+    return Counter({divmod(key, cols.num_senders): count for key, count in counts.items()})
+
+
+def month_starts(cols):
+    """datetime of the first of the month for every message."""
+    uniq, inverse = np.unique(cols.months, return_inverse=True)
+    starts = [datetime(1970 + m // 12, m % 12 + 1, 1) for m in uniq.tolist()]
+    return [starts[i] for i in inverse.tolist()]
+
+
+def decode_varints(data: bytes) -> list:
+    """LEB128 varints, as search_index.decode_varints decodes them one byte at a time."""
+    if not data:
+        return []
+    b = np.frombuffer(data, dtype=np.uint8)
+    last = (b & 0x80) == 0
+    # first byte of every value, and each byte's index within its value
+    starts = np.flatnonzero(np.concatenate(([True], last[:-1])))
+    group = np.cumsum(np.concatenate(([0], last[:-1]))).astype(np.int64)
+    shifts = (7 * (np.arange(len(b)) - starts[group])).astype(np.uint64)
+    values = (b & 0x7F).astype(np.uint64) << shifts
+    return np.add.reduceat(values, starts).tolist()